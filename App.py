@@ -1,13 +1,115 @@
-from tkinter import Tk, Label, Scale, Button, Text, Checkbutton, messagebox, Entry, StringVar, filedialog
+from tkinter import Tk, Label, Scale, Button, Text, Checkbutton, messagebox, Entry, StringVar, filedialog, OptionMenu
+import queue
+import threading
+import time
 
 from PIL import ImageTk, Image, ImageDraw, ImageOps
 import numpy as np
 
 from Radon import Radon
-
-from pydicom.dataset import Dataset, FileDataset
-from pydicom.uid import ExplicitVRLittleEndian
-import pydicom._storage_sopclass_uids
+import Dicom
+import Display
+import Filters
+import Geometry
+
+
+# computes remaining sinogram and reconstruction of a Radon object in a background thread, 'step' iterations at a time;
+# progress is sent to 'messages' queue as ('progress', stage, done, total, elapsed, sinogram, reconstruction) at most
+# every 'frameInterval' seconds, images are None when there is no new image to show ('showFrames' - send partial
+# images, otherwise only final ones), at the end ('done', cancelled) or ('error', exception) is sent;
+# partial images are fast 8-bit previews of 'sinogramSize' and 'reconstructionSize' (width, height) (see Display),
+# final images are full PIL images
+class ScanWorker(threading.Thread):
+
+    def __init__(self, radon, messages, step=1, frameInterval=0.04, showFrames=True, sinogramSize=(400, 400),
+                 reconstructionSize=(400, 400)):
+        super().__init__(daemon=True)
+        self.radon = radon
+        self.messages = messages
+        self.step = step
+        self.frameInterval = frameInterval
+        self.showFrames = showFrames
+        self.cancelled = threading.Event()
+
+        self.sinogramPreview = Display.PreviewBuffer(radon.radonmatrix.shape, sinogramSize)
+        self.reconstructionPreview = Display.PreviewBuffer(radon.reconstrImage.shape, reconstructionSize)
+        # sinogram columns already drawn in the preview
+        self.drawnColumns = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            radon = self.radon
+            self.total = 2 * radon.numberOfIterations - radon.currentSinogramIteration - radon.currentReconstructionIteration
+            self.done = 0
+            self.startTime = time.time()
+            self.lastMessage = 0
+
+            for stage, nextIteration in (('sinogram', radon.nextIteration), ('reconstruction', radon.nextReconstructionIteration)):
+                while not self.cancelled.is_set():
+                    count = nextIteration(self.step)
+                    if count == 0:
+                        break
+                    self.done += count
+                    self.publish(stage, self.showFrames)
+                if self.cancelled.is_set():
+                    break
+                self.publish(stage, True, final=True)
+
+            self.messages.put(('done', self.cancelled.is_set()))
+        except Exception as e:
+            self.messages.put(('error', e))
+
+    def publish(self, stage, withImage, final=False):
+        now = time.time()
+        if not final and now - self.lastMessage < self.frameInterval:
+            return
+        self.lastMessage = now
+        radon = self.radon
+        sinogram = reconstruction = None
+        if final and stage == 'sinogram':
+            sinogram = radon.getSinogram()
+        elif final:
+            reconstruction = radon.getReconstruction()
+        elif withImage and stage == 'sinogram':
+            sinogram = self.sinogramPreview.update(radon.radonmatrixFiltered, Display.scaleFor(radon.sinogramMax),
+                                                   self.drawnColumns, radon.currentSinogramIteration).copy()
+            self.drawnColumns = radon.currentSinogramIteration
+        elif withImage:
+            reconstruction = self.reconstructionPreview.update(radon.reconstrImage,
+                                                               Display.scaleFor(np.max(radon.reconstrImage))).copy()
+        self.messages.put(('progress', stage, self.done, self.total, now - self.startTime, sinogram, reconstruction))
+
+
+# computes coarse previews of a scan (see Radon.generateProgressive) in a background thread, the full resolution
+# level is not computed and the Radon object itself is not changed; messages are the same as of ScanWorker
+class PreviewWorker(threading.Thread):
+
+    def __init__(self, radon, messages, levels=3):
+        super().__init__(daemon=True)
+        self.radon = radon
+        self.messages = messages
+        self.levels = levels
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            startTime = time.time()
+            done = 0
+            for factor, sinogram, reconstruction in self.radon.generateProgressive(self.levels, includeFull=False):
+                if self.cancelled.is_set():
+                    break
+                done += 1
+                self.messages.put(('progress', f'podgląd 1/{factor}', done, self.levels - 1, time.time() - startTime,
+                                   sinogram, reconstruction))
+            self.messages.put(('done', self.cancelled.is_set()))
+        except Exception as e:
+            self.messages.put(('error', e))
 
 
 class App:
@@ -20,13 +122,20 @@ class App:
         self.emittersAngularSpan = 90
         self.rotationDelta = 5
         self.useFilter = True
+        self.filterType = 'ram-lak'
+        self.beam = 'arc'
 
         
         self.isRecFinished = False
 
+        # computation running in background (see ScanWorker) and queue of its messages
+        self.worker = None
+        self.previewLevels = 3   # levels of coarse preview computed after change of parameters (see PreviewWorker)
+
         #display settings
         self.maxImageDisplayWidth = 400
         self.maxImageDisplayHeight = 600
+        self.frameRate = 25   # maximal number of redraws per second during computation
 
 
         # window
@@ -56,6 +165,7 @@ class App:
         # computation status
 
         self.statusLabel = Label(self.window, text="", font='Helvetica 18 bold')
+        cancelButton = Button(self.window, text="anuluj", width=25, command=self.cancelComputation)
 
         # file selction
         selectFileTitleLabel = Label(self.window, text="Wybór pliku:", font='Helvetica 18 bold')
@@ -89,8 +199,17 @@ class App:
         rotationDeltaInput['validatecommand'] = (rotationDeltaInput.register(self.validate_rotationDeltaInput), '%P')
         self.rotationDeltaVar.set(self.rotationDelta)
 
-        filterCheckBox = Checkbutton(self.window, text='filtruj sinogram', onvalue=1, offvalue=0, command=self.changeFilter)
-        filterCheckBox.select()
+        self.filterCheckBox = Checkbutton(self.window, text='filtruj sinogram', onvalue=1, offvalue=0, command=self.changeFilter)
+        self.filterCheckBox.select()
+
+        self.filterTypeVar = StringVar()
+        self.filterTypeVar.set(self.filterType)
+        filterTypeMenu = OptionMenu(self.window, self.filterTypeVar, *Filters.FILTER_TYPES)
+
+        # scanner geometry (see Geometry.BEAMS)
+        self.beamVar = StringVar()
+        self.beamVar.set(self.beam)
+        beamMenu = OptionMenu(self.window, self.beamVar, *Geometry.BEAMS)
 
         # Button to apply settings and reset generated images
         applyParamsButton = Button(self.window, text="zastosuj i resetuj sinogram", width=25, command=self.applyParams)
@@ -101,6 +220,10 @@ class App:
         # Button to render sinogram and reconstruction iteration by iteration
         nextIterationButton = Button(self.window, text="rysuj iteracyjnie", width=25, command=self.runAnimation)
 
+        # Buttons to save current scan (with its progress) and to reopen saved scan
+        saveScanButton = Button(self.window, text="zapisz skan", width=25, command=self.saveScan)
+        openScanButton = Button(self.window, text="otwórz zapisany skan", width=25, command=self.openScan)
+
         # DICOM info inputs
         dicomTitleLabel = Label(self.window, text="Eksport do pliku DICOM:", font='Helvetica 18 bold')
 
@@ -119,6 +242,12 @@ class App:
         filenamelabel = Label(self.window, text="nazwa pliku")
         self.filenametxt = Text(self.window, height=1, width=20)
 
+        # bits per pixel of DICOM image (12 and 16 bits keep dynamic range of reconstruction)
+        bitslabel = Label(self.window, text="bity na piksel")
+        self.dicomBitsVar = StringVar()
+        self.dicomBitsVar.set('8')
+        dicomBitsMenu = OptionMenu(self.window, self.dicomBitsVar, '8', '12', '16')
+
         # button to save DICOM
         self.createDicomButton = Button(self.window, text="stwórz dicom", command=self.createDicom)
 
@@ -126,6 +255,7 @@ class App:
         # layout
 
         self.statusLabel.grid(column=4, row=2)
+        cancelButton.grid(column=4, row=3)
 
         selectFileTitleLabel.grid(column=0, row = 1, sticky='W')
         selectFileButton.grid(column=1, row = 2)
@@ -145,11 +275,15 @@ class App:
         rotationDeltaLabel.grid(column=0, row=7)
         rotationDeltaInput.grid(column=1, row=7)
 
-        filterCheckBox.grid(column=1, row=8)
+        self.filterCheckBox.grid(column=1, row=8)
+        filterTypeMenu.grid(column=2, row=8)
+        beamMenu.grid(column=2, row=7)
 
         applyParamsButton.grid(column=3, row=5, sticky='W')
         generateButton.grid(column=3, row=6, sticky='W')
         nextIterationButton.grid(column=3, row=7, sticky='W')
+        saveScanButton.grid(column=3, row=8, sticky='W')
+        openScanButton.grid(column=3, row=9, sticky='W')
 
         dicomTitleLabel.grid(column=0,row=9, sticky='W')
         namelabel.grid(column=0,row=10)
@@ -162,22 +296,35 @@ class App:
         self.commenttxt.grid(column=1, row=13)
         filenamelabel.grid(column=0, row=14)
         self.filenametxt.grid(column=1, row=14)
+        bitslabel.grid(column=0, row=15)
+        dicomBitsMenu.grid(column=1, row=15)
 
 
         # create object that takes care of all CT computations
         self.radonTransformator = Radon(self.baseImage)
 
+        self.window.protocol('WM_DELETE_WINDOW', self.closeWindow)
         self.window.mainloop()
 
     # returns image resized to fit in limits set in maxImageDisplayWidth and maxImageDisplayHeight variables
     def resizeToFitLimits(self, image):
-        newShape = (0, 0)
-        if image.size[0] > image.size[1]:
-            newShape = (self.maxImageDisplayHeight, int(self.maxImageDisplayHeight * (image.size[1] / image.size[0])) + 1)
-        else:
-            newShape = (int(self.maxImageDisplayWidth * (image.size[0] / image.size[1])) + 1, self.maxImageDisplayWidth)
+        return image.resize(self.displaySize(image.size), resample=Image.BICUBIC)
 
-        return image.resize(newShape, resample=Image.BICUBIC)
+    # size of displayed image of given size (width, height)
+    def displaySize(self, size):
+        return Display.fitSize(size, self.maxImageDisplayWidth, self.maxImageDisplayHeight)
+
+    # shows image in 'photo' and returns the photo image; 'image' is PIL image (resized with high quality) or
+    # 8-bit preview already of display size, photo image is reused when it has the same size
+    def updatePhoto(self, photo, image):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        else:
+            image = self.resizeToFitLimits(image)
+        if photo is not None and (photo.width(), photo.height()) == image.size:
+            photo.paste(image)
+            return photo
+        return ImageTk.PhotoImage(image)
 
     # display original image
     def setImage(self, image):
@@ -186,18 +333,20 @@ class App:
 
     # display sinogram
     def showSinogram(self, sinogram):
-        self.sinImg = ImageTk.PhotoImage(self.resizeToFitLimits(sinogram))
+        self.sinImg = self.updatePhoto(self.sinImg, sinogram)
         self.sinImgLabel.config(image=self.sinImg)
 
     # display reconstructed image
     def showReconstruction(self, reconstruction):
-        self.recImg = ImageTk.PhotoImage(self.resizeToFitLimits(reconstruction))
+        self.recImg = self.updatePhoto(self.recImg, reconstruction)
         self.recImgLabel.config(image=self.recImg)
     
 
     # event handlers
 
     def selectFile(self):
+        if self.isComputing():
+            return
         filename = filedialog.askopenfilename()
 
         if filename != '':
@@ -214,6 +363,8 @@ class App:
         self.useFilter = not self.useFilter
 
     def applyParams(self):
+        if self.isComputing():
+            return
         self.isRecFinished = False
 
         self.startRotation = int(self.startRotationVar.get())
@@ -228,13 +379,67 @@ class App:
         self.rotationDelta = float(self.rotationDeltaVar.get())
         self.rotationDeltaVar.set(self.rotationDelta)
 
+        self.filterType = self.filterTypeVar.get()
+        self.beam = self.beamVar.get()
+
         self.radonTransformator.configAndReset(startRotation=np.radians(self.startRotation),
                                                numberOfEmitters=self.numberOfEmitters,
                                                emittersAngularSpan=np.radians(self.emittersAngularSpan),
                                                rotationDelta=np.radians(self.rotationDelta),
-                                               useFilter=self.useFilter)
+                                               useFilter=self.useFilter,
+                                               filterType=self.filterType,
+                                               beam=self.beam)
         self.showSinogram(self.radonTransformator.getSinogram())
         self.showReconstruction(self.radonTransformator.getReconstruction())
+        self.startPreview()
+
+    def saveScan(self):
+        if self.isComputing():
+            return
+        filename = filedialog.asksaveasfilename(defaultextension='.npz', filetypes=[('zapisany skan', '*.npz')])
+        if filename != '':
+            self.radonTransformator.save_state(filename)
+
+    # reopens scan saved with saveScan, computed sinogram and reconstruction are shown without computing them again
+    def openScan(self):
+        if self.isComputing():
+            return
+        filename = filedialog.askopenfilename(filetypes=[('zapisany skan', '*.npz')])
+        if filename == '':
+            return
+        try:
+            radon = Radon.load_state(filename)
+        except (ValueError, KeyError, OSError) as e:
+            messagebox.showinfo(title="Error opening scan", message=str(e))
+            return
+
+        self.radonTransformator.close()
+        self.radonTransformator = radon
+        self.selectedFileNameLabel.config(text=filename[filename.rindex('/')+1:])
+        self.baseImage = radon.baseImage
+        self.setImage(self.baseImage)
+
+        self.startRotation = int(round(np.degrees(radon.startRotation)))
+        self.startRotationVar.set(self.startRotation)
+        self.numberOfEmitters = radon.numberOfEmitters
+        self.countVar.set(self.numberOfEmitters)
+        self.emittersAngularSpan = int(round(np.degrees(radon.emittersAngularSpan)))
+        self.spanVar.set(self.emittersAngularSpan)
+        self.rotationDelta = float(np.degrees(radon.rotationDelta))
+        self.rotationDeltaVar.set(self.rotationDelta)
+        self.useFilter = radon.useFilter
+        if self.useFilter:
+            self.filterCheckBox.select()
+        else:
+            self.filterCheckBox.deselect()
+        self.filterType = radon.filterType
+        self.filterTypeVar.set(self.filterType)
+        self.beam = radon.beam
+        self.beamVar.set(self.beam)
+
+        self.showSinogram(radon.getSinogram())
+        self.showReconstruction(radon.getReconstruction())
+        self.setStatusComplete(radon.currentReconstructionIteration >= radon.numberOfIterations)
 
     # call this function with complete=False, when computations starts, and with complete=True when computation finished
     def setStatusComplete(self, complete):
@@ -246,33 +451,97 @@ class App:
             self.statusLabel.config(text="Przetwarzanie w toku")
             self.isRecFinished = False
 
+    # computes sinogram and reconstruction in chunks of about 1% of iterations, only final images are shown
     def generateSinogram(self):
-        self.setStatusComplete(False)
-        self.window.update()
-        
-        self.radonTransformator.generateSinogram()
-        self.showSinogram(self.radonTransformator.getSinogram())
-        self.radonTransformator.generateReconstruction(from_iteration=0)
-        self.showReconstruction(self.radonTransformator.getReconstruction())
+        self.startComputation(step=max(1, self.radonTransformator.numberOfIterations // 100), showFrames=False)
 
-        # self.radonTransformator.getRMSE()  # oblicz blad sredniokwadratowy
+    # computes sinogram and reconstruction iteration by iteration, partial images are shown at most frameRate times per second
+    def runAnimation(self):
+        self.startComputation(step=1, showFrames=True)
 
-        self.setStatusComplete(True)
+    # True when scan is being computed; preview never blocks other actions, it is cancelled here
+    def isComputing(self):
+        if isinstance(self.worker, PreviewWorker):
+            self.worker.cancel()
+            self.worker = None
+        return self.worker is not None
 
-    def runAnimation(self):
+    def startComputation(self, step, showFrames):
+        if self.isComputing():
+            return
         self.setStatusComplete(False)
+        radon = self.radonTransformator
+        self.startWorker(ScanWorker(radon, queue.Queue(), step=step, frameInterval=1 / self.frameRate, showFrames=showFrames,
+                                    sinogramSize=self.displaySize(radon.radonmatrix.shape[::-1]),
+                                    reconstructionSize=self.displaySize(radon.reconstrImage.shape[::-1])))
+
+    # shows coarse previews of the scan with current parameters, computed at lower resolutions
+    def startPreview(self):
+        if self.isComputing():
+            return
+        self.startWorker(PreviewWorker(self.radonTransformator, queue.Queue(), levels=self.previewLevels))
+
+    def startWorker(self, worker):
+        self.worker = worker
+        self.worker.start()
+        self.window.after(int(1000 / self.frameRate), self.pollWorker, worker)
 
-        while self.radonTransformator.nextIteration() > 0:
-            self.showSinogram(self.radonTransformator.getSinogram())
-            self.window.update()
+    def cancelComputation(self):
+        if self.worker is not None:
+            self.worker.cancel()
 
-        while self.radonTransformator.nextReconstructionIteration() > 0:
-            self.showReconstruction(self.radonTransformator.getReconstruction())
-            self.window.update()
+    def closeWindow(self):
+        self.cancelComputation()
+        self.window.destroy()
 
-        # self.radonTransformator.getRMSE()  # oblicz blad sredniokwadratowy
+    # handles messages of the background computation, only the newest images are shown;
+    # messages of a worker which was replaced by another one are ignored
+    def pollWorker(self, worker):
+        if worker is not self.worker:
+            return
+        sinogram = reconstruction = progress = None
+        finished = False
+        while True:
+            try:
+                message = worker.messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                progress = message[1:5]
+                sinogram = message[5] if message[5] is not None else sinogram
+                reconstruction = message[6] if message[6] is not None else reconstruction
+            elif message[0] == 'done':
+                finished = True
+                cancelled = message[1]
+            elif message[0] == 'error':
+                finished = True
+                cancelled = True
+                messagebox.showinfo(title="Error", message=str(message[1]))
+
+        if sinogram is not None:
+            self.showSinogram(sinogram)
+        if reconstruction is not None:
+            self.showReconstruction(reconstruction)
+
+        if finished:
+            self.worker = None
+            if cancelled:
+                self.statusLabel.config(text="Przetwarzanie przerwane")
+            elif isinstance(worker, PreviewWorker):
+                self.statusLabel.config(text="Podgląd gotowy")
+            else:
+                self.setStatusComplete(True)
+                metrics = self.radonTransformator.getMetrics()
+                self.statusLabel.config(text=f"Przetwarzanie zakończone\nRMSE = {metrics['rmse']:.2f}, "
+                                             f"PSNR = {metrics['psnr']:.2f} dB, SSIM = {metrics['ssim']:.3f}")
+            return
 
-        self.setStatusComplete(True)
+        if progress is not None:
+            stage, done, total, elapsed = progress
+            remaining = elapsed / done * (total - done) if done > 0 else 0
+            self.statusLabel.config(text=f"Przetwarzanie w toku: {stage} {100 * done / max(total, 1):.0f}%, "
+                                         f"pozostało ok. {remaining:.0f} s")
+        self.window.after(int(1000 / self.frameRate), self.pollWorker, worker)
 
 
     # DICOM handling
@@ -294,73 +563,20 @@ class App:
             messagebox.showinfo(title="Input error", message="data powinna być podana w formacie YYYYMMDD")
         else:
             filename = self.filenametxt.get("1.0", 'end-1c')
-            self.save_as_dicom(filename + '.dcm', self.radonTransformator.getReconstruction(),patient_data)
+            bits = int(self.dicomBitsVar.get())
+            if bits == 8:
+                self.save_as_dicom(filename + '.dcm', self.radonTransformator.getReconstruction(), patient_data)
+            else:
+                self.save_as_dicom(filename + '.dcm', self.radonTransformator.getReconstructionArray(bits), patient_data, bits)
 
             messagebox.showinfo(title="Success", message="utworzono plik DICOM")
 
     def read_dicom(self, file_name):
-        # load dicom file
-        ds = pydicom.dcmread(file_name)
-
-        print("DICOM info")
-        print("Patient Name:", ds.PatientName)
-        print("Patient ID:", ds.PatientID)
-        print("Study date:", ds.StudyDate)
-        print("Image comments:", ds.ImageComments)
-        print("Modality:", ds.Modality)
-        print("Image size:", ds.Rows, "x", ds.Columns)
-
-    def save_as_dicom(self, file_name, img, patient_data): # funkcja z ekursy
-
-        img_converted = np.array(img.convert('L'))
-
-        # Populate required values for file meta information
-        meta = Dataset()
-        meta.MediaStorageSOPClassUID = pydicom._storage_sopclass_uids.CTImageStorage
-        meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
-        meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
-
-        ds = FileDataset(None, {}, preamble=b"\0" * 128)
-        ds.file_meta = meta
-
-        ds.is_little_endian = True
-        ds.is_implicit_VR = False
-
-        ds.SOPClassUID = pydicom._storage_sopclass_uids.CTImageStorage
-        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
-
-        ds.PatientName = patient_data["PatientName"]
-        ds.PatientID = patient_data["PatientID"]
-        ds.StudyDate = patient_data["StudyDate"]
-        ds.ImageComments = patient_data["ImageComments"]
-
-        ds.Modality = "CT"
-        ds.SeriesInstanceUID = pydicom.uid.generate_uid()
-        ds.StudyInstanceUID = pydicom.uid.generate_uid()
-        ds.FrameOfReferenceUID = pydicom.uid.generate_uid()
-
-        ds.BitsStored = 8
-        ds.BitsAllocated = 8
-        ds.SamplesPerPixel = 1
-        ds.HighBit = 15
-
-        ds.ImagesInAcquisition = 1
-        ds.InstanceNumber = 1
-
-        ds.Rows, ds.Columns = img_converted.shape[:2]
-
-        ds.ImageType = r"ORIGINAL\PRIMARY\AXIAL"
-
-        ds.PhotometricInterpretation = "MONOCHROME2"
-        ds.PixelRepresentation = 0
-
-        pydicom.dataset.validate_file_meta(ds.file_meta, enforce_standard=True)
-
-        ds.PixelData = img_converted.tobytes()
-
-        ds.save_as(file_name, write_like_original=False)
+        Dicom.read_dicom(file_name)
 
-        self.read_dicom(file_name)
+    def save_as_dicom(self, file_name, img, patient_data, bits=8):
+        # information is printed from the saved dataset, the file is not read back
+        Dicom.print_dicom_info(Dicom.save_as_dicom(file_name, img, patient_data, bits))
 
 
     # input validation
@@ -0,0 +1,139 @@
+# headless batch processing: scan -> sinogram -> reconstruction for many images, without the GUI
+# usage example: python Batch.py example_images/ "scans/*.png" -o output --emitters 180 --span 180 --delta 1 --workers 8
+
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import time
+
+from PIL import Image
+import numpy as np
+
+import Geometry
+from Radon import PRECISIONS, Radon
+import Subsampling
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.gif')
+
+
+# expands directories and glob patterns into sorted list of image files
+def findImages(inputs):
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        files.extend(f for f in candidates if os.path.isfile(f) and f.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(set(files))
+
+
+# runs whole simulation for one image and writes results to 'outputDir', returns summary row
+def processImage(fileName, outputDir, params, patientData=None):
+    name = os.path.splitext(os.path.basename(fileName))[0]
+    row = {'image': fileName}
+
+    s_time = time.time()
+    radon = Radon(Image.open(fileName), startRotation=np.radians(params['startRotation']),
+                  numberOfEmitters=params['numberOfEmitters'], emittersAngularSpan=np.radians(params['emittersAngularSpan']),
+                  rotationDelta=np.radians(params['rotationDelta']), useFilter=params['useFilter'],
+                  beam=params.get('beam', 'arc'), dtype=params.get('dtype', np.float64), geometryCache=params.get('geometryCache'))
+    row['setup_s'] = time.time() - s_time
+
+    s_time = time.time()
+    if params.get('angleStep', 1) > 1 or params.get('detectorStep', 1) > 1:
+        radon.generateSubsampledSinogram(params['angleStep'], params['detectorStep'], params['interpolation'])
+    else:
+        radon.generateSinogram()
+    row['sinogram_s'] = time.time() - s_time
+
+    s_time = time.time()
+    radon.generateReconstruction(from_iteration=0)
+    row['reconstruction_s'] = time.time() - s_time
+
+    radon.getSinogram().convert('L').save(os.path.join(outputDir, name + '_sinogram.png'))
+    radon.getReconstruction().convert('L').save(os.path.join(outputDir, name + '_reconstruction.png'))
+    if patientData is not None:
+        # imported only when needed, pydicom is not required for plain image output
+        import Dicom
+        bits = params.get('dicomBits', 8)
+        image = radon.getReconstruction() if bits == 8 else radon.getReconstructionArray(bits)
+        Dicom.save_as_dicom(os.path.join(outputDir, name + '.dcm'), image, patientData, bits)
+
+    row.update(radon.getMetrics())
+    row['total_s'] = row['setup_s'] + row['sinogram_s'] + row['reconstruction_s']
+    return row
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='computed tomography scan simulator - batch mode')
+    parser.add_argument('inputs', nargs='+', help='image files, directories or glob patterns')
+    parser.add_argument('-o', '--output', default='output', help='output directory')
+    parser.add_argument('--start-rotation', type=float, default=0, help='start rotation in degrees')
+    parser.add_argument('--emitters', type=int, default=10, help='number of emitters')
+    parser.add_argument('--span', type=float, default=90, help='angular span of emitters in degrees')
+    parser.add_argument('--delta', type=float, default=5, help='rotation delta in degrees')
+    parser.add_argument('--no-filter', action='store_true', help='do not filter sinogram')
+    parser.add_argument('--beam', choices=list(Geometry.BEAMS), default='arc',
+                        help="scanner geometry ('fan' - single source, span is the fan angle)")
+    parser.add_argument('--angle-step', type=int, default=1, help='project every n-th angle, interpolate the rest')
+    parser.add_argument('--detector-step', type=int, default=1, help='project every n-th detector, interpolate the rest')
+    parser.add_argument('--interpolation', choices=Subsampling.METHODS, default='linear',
+                        help='interpolation of subsampled sinogram')
+    parser.add_argument('--precision', choices=list(PRECISIONS), default='double', help='type of sinogram and reconstruction arrays')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of images processed concurrently')
+    parser.add_argument('--geometry-cache', help='directory of on-disk cache of ray geometries shared by workers and runs')
+    parser.add_argument('--dicom', action='store_true', help='save reconstructions also as DICOM files')
+    parser.add_argument('--dicom-bits', type=int, choices=(8, 12, 16), default=8, help='bits per pixel of DICOM files')
+    parser.add_argument('--patient-name', default='')
+    parser.add_argument('--patient-id', default='')
+    parser.add_argument('--study-date', default='')
+    parser.add_argument('--comment', default='')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    files = findImages(args.inputs)
+    if not files:
+        print("no input images found")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    params = {'startRotation': args.start_rotation, 'numberOfEmitters': args.emitters,
+              'emittersAngularSpan': args.span, 'rotationDelta': args.delta, 'useFilter': not args.no_filter,
+              'beam': args.beam, 'dtype': PRECISIONS[args.precision], 'geometryCache': args.geometry_cache,
+              'dicomBits': args.dicom_bits, 'angleStep': args.angle_step, 'detectorStep': args.detector_step,
+              'interpolation': args.interpolation}
+    patientData = None
+    if args.dicom:
+        patientData = {'PatientName': args.patient_name, 'PatientID': args.patient_id,
+                       'StudyDate': args.study_date, 'ImageComments': args.comment}
+
+    s_time = time.time()
+    rows = []
+    if args.workers is None or args.workers <= 1:
+        for f in files:
+            rows.append(processImage(f, args.output, params, patientData))
+            print(f"{f}: {rows[-1]['total_s']:.3f} s, RMSE = {rows[-1]['rmse']:.3f}")
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(processImage, f, args.output, params, patientData) for f in files]
+            for f, future in zip(files, futures):
+                rows.append(future.result())
+                print(f"{f}: {rows[-1]['total_s']:.3f} s, RMSE = {rows[-1]['rmse']:.3f}")
+
+    with open(os.path.join(args.output, 'summary.csv'), 'w', newline='') as summaryFile:
+        writer = csv.DictWriter(summaryFile, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"processed {len(rows)} images in {time.time() - s_time:.3f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
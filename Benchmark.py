@@ -0,0 +1,194 @@
+# benchmark of Radon phases (geometry, sinogram, filtering, reconstruction) over images and scan parameters;
+# results are written as JSON and can be compared with a saved baseline, e.g.:
+#   python Benchmark.py --output baseline.json
+#   python Benchmark.py --output current.json --baseline baseline.json --threshold 0.2
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+from PIL import Image
+import numpy as np
+
+import Geometry
+from Radon import Radon
+
+DEFAULT_IMAGES = ['example_images/Shepp_logan.jpg', 'example_images/CT_ScoutView-large.jpg', 'example_images/SADDLE_PE-large.JPG']
+
+# ellipses of modified Shepp-Logan phantom: intensity, semi-axes, center, rotation in degrees (coordinates in [-1, 1])
+PHANTOM_ELLIPSES = [
+    (1.0, 0.69, 0.92, 0, 0, 0),
+    (-0.8, 0.6624, 0.874, 0, -0.0184, 0),
+    (-0.2, 0.11, 0.31, 0.22, 0, -18),
+    (-0.2, 0.16, 0.41, -0.22, 0, 18),
+    (0.1, 0.21, 0.25, 0, 0.35, 0),
+    (0.1, 0.046, 0.046, 0, 0.1, 0),
+    (0.1, 0.046, 0.046, 0, -0.1, 0),
+    (0.1, 0.046, 0.023, -0.08, -0.605, 0),
+    (0.1, 0.023, 0.023, 0, -0.606, 0),
+    (0.1, 0.023, 0.046, 0.06, -0.605, 0),
+]
+
+
+# synthetic Shepp-Logan phantom of size x size pixels
+def phantom(size):
+    y, x = np.mgrid[1:-1:size * 1j, -1:1:size * 1j]
+    image = np.zeros((size, size))
+    for intensity, a, b, x0, y0, angle in PHANTOM_ELLIPSES:
+        angle = np.radians(angle)
+        xr = (x - x0) * np.cos(angle) + (y - y0) * np.sin(angle)
+        yr = -(x - x0) * np.sin(angle) + (y - y0) * np.cos(angle)
+        image[(xr / a) ** 2 + (yr / b) ** 2 <= 1] += intensity
+    return Image.fromarray(np.uint8(np.clip(image, 0, 1) * 255))
+
+
+# runs 'function' and returns its wall time and peak memory allocated during the call (in bytes)
+def measure(function):
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    s_time = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - s_time
+    return elapsed, tracemalloc.get_traced_memory()[1] - start
+
+
+# benchmark of one image with one set of parameters, returns result for every phase (best of 'repeat' runs);
+# sinogram phase is the projection only, filtering is measured separately by filter phase
+def benchmarkCase(image, numberOfEmitters, rotationDelta, useFilter, projector, reconstructionMode, repeat):
+    phases = {}
+
+    # 'setup' is called before every run and is not measured
+    def record(name, function, rays=None, setup=None):
+        best = None
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            elapsed, peak = measure(function)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, peak)
+        phases[name] = {'time_s': best[0], 'peak_memory_bytes': best[1]}
+        if rays is not None:
+            phases[name]['rays_per_s'] = rays / best[0] if best[0] > 0 else None
+
+    radon = Radon(image, numberOfEmitters=numberOfEmitters, emittersAngularSpan=np.radians(180),
+                  rotationDelta=np.radians(rotationDelta), useFilter=False, projector=projector,
+                  reconstructionMode=reconstructionMode)
+
+    def buildGeometry():
+        Geometry.getGeometry.cache_clear()
+        radon.geometry = None
+        radon.getGeometry()
+
+    def clearReconstruction():
+        radon.reconstrImage[...] = 0
+        radon.currentReconstructionIteration = 0
+
+    record('geometry', buildGeometry)
+    numberOfRays = radon.getGeometry().numberOfRays
+    record('sinogram', radon.generateSinogram, numberOfRays, setup=radon.reset)
+    if useFilter:
+        record('filter', lambda: radon.filter(radon.radonmatrix))
+        # reconstruction is computed from filtered sinogram
+        sinogram = radon.radonmatrix.copy()
+        radon.configAndReset(useFilter=True)
+        radon.setSinogram(sinogram)
+    record('reconstruction', lambda: radon.generateReconstruction(from_iteration=0), numberOfRays, setup=clearReconstruction)
+
+    return {'rays': numberOfRays, 'nnz': radon.getGeometry().nnz, 'phases': phases}
+
+
+def loadImages(args):
+    images = {}
+    for fileName in args.images:
+        images[os.path.basename(fileName)] = Image.open(fileName)
+    for size in args.sizes:
+        images[f'phantom{size}'] = phantom(size)
+    return images
+
+
+def runBenchmark(args):
+    results = []
+    tracemalloc.start()
+    for (name, image), numberOfEmitters, rotationDelta, useFilter, projector, mode in itertools.product(
+            loadImages(args).items(), args.emitters, args.deltas, args.filters, args.projectors, args.modes):
+        case = {'image': name, 'size': list(np.array(image.convert('L')).shape), 'numberOfEmitters': numberOfEmitters,
+                'rotationDelta': rotationDelta, 'useFilter': useFilter, 'projector': projector, 'reconstructionMode': mode}
+        case.update(benchmarkCase(image, numberOfEmitters, rotationDelta, useFilter, projector, mode, args.repeat))
+        results.append(case)
+
+        times = ', '.join(f"{phase} {r['time_s']:.3f} s" for phase, r in case['phases'].items())
+        print(f"{name} emitters={numberOfEmitters} delta={rotationDelta} filter={useFilter} {projector}/{mode}: {times}")
+    tracemalloc.stop()
+    return results
+
+
+# identifies the same benchmark case in different result files
+def caseKey(case):
+    return (case['image'], case['numberOfEmitters'], case['rotationDelta'], case['useFilter'],
+            case.get('projector', 'bresenham'), case.get('reconstructionMode', 'ray'))
+
+
+# returns list of phases which are slower than in baseline by more than 'threshold' (relative),
+# phases faster than 'minTime' seconds are too noisy and are not compared
+def compareWithBaseline(results, baseline, threshold, minTime=0.01):
+    baselineCases = {caseKey(case): case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        old = baselineCases.get(caseKey(case))
+        if old is None:
+            continue
+        for phase, r in case['phases'].items():
+            if phase not in old['phases'] or max(r['time_s'], old['phases'][phase]['time_s']) < minTime:
+                continue
+            if r['time_s'] > old['phases'][phase]['time_s'] * (1 + threshold):
+                regressions.append({'case': caseKey(case), 'phase': phase,
+                                    'baseline_s': old['phases'][phase]['time_s'], 'current_s': r['time_s']})
+    return regressions
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark of computed tomography scan simulator')
+    parser.add_argument('--images', nargs='*', default=DEFAULT_IMAGES, help='image files')
+    parser.add_argument('--sizes', nargs='*', type=int, default=[128, 256, 512], help='sizes of synthetic phantoms (e.g. 128 - 2048)')
+    parser.add_argument('--emitters', nargs='+', type=int, default=[90, 180], help='numbers of emitters')
+    parser.add_argument('--deltas', nargs='+', type=float, default=[2], help='rotation deltas in degrees')
+    parser.add_argument('--filters', nargs='+', type=int, choices=[0, 1], default=[0, 1], help='use filter (0/1)')
+    parser.add_argument('--projectors', nargs='+', default=['bresenham'])
+    parser.add_argument('--modes', nargs='+', default=['ray'], help='reconstruction modes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every phase, the best one is reported')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file with results')
+    parser.add_argument('--baseline', help='JSON file with results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown against baseline')
+    parser.add_argument('--min-time', type=float, default=0.01, help='phases faster than this (seconds) are not compared')
+    args = parser.parse_args(argv)
+    args.filters = [bool(f) for f in args.filters]
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    results = runBenchmark(args)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count(), 'results': results}
+    with open(args.output, 'w') as outputFile:
+        json.dump(report, outputFile, indent=2)
+    print("results saved to", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = compareWithBaseline(results, json.load(baselineFile), args.threshold, args.min_time)
+        for r in regressions:
+            print(f"REGRESSION {r['case']} {r['phase']}: {r['baseline_s']:.3f} s -> {r['current_s']:.3f} s")
+        if regressions:
+            return 1
+        print("no regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
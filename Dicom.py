@@ -0,0 +1,276 @@
+import os
+import queue
+import struct
+import threading
+
+from pydicom.dataset import Dataset, FileDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+import pydicom._storage_sopclass_uids
+from PIL import Image
+import numpy as np
+
+
+# prints basic information stored in DICOM file
+def read_dicom(file_name):
+    # load dicom file
+    ds = pydicom.dcmread(file_name)
+    print_dicom_info(ds)
+
+
+# prints basic information of DICOM dataset (e.g. returned by save_as_dicom, without reading the file back)
+def print_dicom_info(ds):
+    print("DICOM info")
+    print("Patient Name:", ds.PatientName)
+    print("Patient ID:", ds.PatientID)
+    print("Study date:", ds.StudyDate)
+    print("Image comments:", ds.ImageComments)
+    print("Modality:", ds.Modality)
+    print("Image size:", ds.Rows, "x", ds.Columns)
+
+
+# sets pixel format of 'bits' bits per pixel (8 - one byte, 12 or 16 - two bytes) in dataset 'ds'
+def set_pixel_format(ds, bits):
+    ds.BitsStored = bits
+    ds.BitsAllocated = 8 if bits <= 8 else 16
+    ds.SamplesPerPixel = 1
+    ds.HighBit = bits - 1
+    if bits > 8:
+        # default window shows the whole range, viewers do not have to guess it from the pixel data
+        ds.WindowCenter = (1 << bits) // 2
+        ds.WindowWidth = 1 << bits
+
+
+# pixel data of 'bits' bits per pixel as bytes, values are expected in 0 - (2^bits - 1)
+def pixel_bytes(pixels, bits):
+    return np.ascontiguousarray(pixels, dtype=np.uint8 if bits <= 8 else np.uint16).tobytes()
+
+
+# new image dataset (CT Image unless other 'sop_class' is given) of 'rows' x 'columns' pixels with given patient data;
+# study, series and frame of reference UIDs are taken from patient_data (keys 'StudyInstanceUID', 'SeriesInstanceUID',
+# 'FrameOfReferenceUID') when it has them, so images of one series or study can share them, otherwise new UIDs are generated
+def new_dataset(patient_data, rows, columns, bits=8, sop_class=pydicom._storage_sopclass_uids.CTImageStorage):
+    # Populate required values for file meta information
+    meta = Dataset()
+    meta.MediaStorageSOPClassUID = sop_class
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = FileDataset(None, {}, preamble=b"\0" * 128)
+    ds.file_meta = meta
+
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+
+    ds.PatientName = patient_data.get("PatientName", "")
+    ds.PatientID = patient_data.get("PatientID", "")
+    ds.StudyDate = patient_data.get("StudyDate", "")
+    ds.ImageComments = patient_data.get("ImageComments", "")
+
+    ds.Modality = "CT"
+    ds.SeriesInstanceUID = patient_data.get("SeriesInstanceUID") or generate_uid()
+    ds.StudyInstanceUID = patient_data.get("StudyInstanceUID") or generate_uid()
+    ds.FrameOfReferenceUID = patient_data.get("FrameOfReferenceUID") or generate_uid()
+
+    set_pixel_format(ds, bits)
+
+    ds.ImagesInAcquisition = 1
+    ds.InstanceNumber = 1
+
+    ds.Rows, ds.Columns = rows, columns
+
+    ds.ImageType = r"ORIGINAL\PRIMARY\AXIAL"
+
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.PixelRepresentation = 0
+
+    pydicom.dataset.validate_file_meta(ds.file_meta, enforce_standard=True)
+    return ds
+
+
+# saves image (PIL) as DICOM file with given patient data; with 'bits' 12 or 16 'img' is an array of 0 - (2^bits - 1)
+# values (e.g. Radon.getReconstructionArray(bits)), which keeps the dynamic range lost by 8-bit conversion;
+# returns saved dataset
+def save_as_dicom(file_name, img, patient_data, bits=8): # funkcja z ekursy
+
+    if bits <= 8:
+        img_converted = np.array(img.convert('L') if isinstance(img, Image.Image) else Image.fromarray(img).convert('L'))
+    else:
+        img_converted = np.asarray(img)
+
+    ds = new_dataset(patient_data, *img_converted.shape[:2], bits)
+    ds.PixelData = pixel_bytes(img_converted, bits)
+
+    ds.save_as(file_name, write_like_original=False)
+    return ds
+
+
+# number of bytes of frames copied to a multi-frame file at once (see save_frames_as_dicom)
+FRAME_CHUNK_BYTES = 16 << 20
+
+
+# saves frames (array of shape frames x rows x columns, e.g. memory-mapped) as one multi-frame DICOM file,
+# values of frames are expected in 0 - (2^bits - 1); CT Image is a single-frame object, so the file is
+# a multi-frame grayscale secondary capture (byte for 8 bits, word for 12 and 16 bits); the dataset is written
+# without pixel data, which is then appended frame by frame in chunks of FRAME_CHUNK_BYTES, so memory used
+# does not depend on the number of frames
+def save_frames_as_dicom(file_name, frames, patient_data, bits=8):
+    if bits <= 8:
+        sop_class = pydicom._storage_sopclass_uids.MultiFrameGrayscaleByteSecondaryCaptureImageStorage
+    else:
+        sop_class = pydicom._storage_sopclass_uids.MultiFrameGrayscaleWordSecondaryCaptureImageStorage
+    ds = new_dataset(patient_data, *frames.shape[1:3], bits, sop_class)
+    del ds.ImagesInAcquisition
+    ds.ImageType = r"DERIVED\SECONDARY"
+    ds.ConversionType = "WSD"
+
+    # frames are slices one after another, identified by their slice locations
+    ds.NumberOfFrames = frames.shape[0]
+    ds.FrameIncrementPointer = pydicom.tag.Tag("SliceLocationVector")
+    ds.SliceLocationVector = list(range(frames.shape[0]))
+
+    # pixel values are stored as they are
+    ds.RescaleIntercept = 0
+    ds.RescaleSlope = 1
+    ds.RescaleType = "US"
+
+    dtype = np.dtype(np.uint8 if bits <= 8 else '<u2')
+    length = frames.shape[0] * frames.shape[1] * frames.shape[2] * dtype.itemsize
+    with open(file_name, 'wb') as dicom_file:
+        ds.save_as(dicom_file, write_like_original=False)
+        # Pixel Data (7FE0,0010) element header in explicit VR little endian: tag, VR, reserved bytes, even length
+        vr = b'OB' if bits <= 8 else b'OW'
+        dicom_file.write(struct.pack('<HH2sHI', 0x7FE0, 0x0010, vr, 0, length + length % 2))
+        step = max(1, FRAME_CHUNK_BYTES // max(1, frames[0].size * dtype.itemsize))
+        for first in range(0, frames.shape[0], step):
+            dicom_file.write(np.ascontiguousarray(frames[first:first + step], dtype=dtype).tobytes())
+        if length % 2:
+            dicom_file.write(b'\0')
+
+
+# writes slices of a volume as DICOM series: one file per slice in 'directory', with shared study, series and
+# frame of reference UIDs, instance numbers and slice positions ('slice_spacing' apart); files are written by
+# a background thread, slices wait in a queue of at most 'queue_size' slices, so computation is blocked only
+# when writing falls behind; errors of the thread are raised by write and close
+class SeriesWriter:
+
+    _END = object()
+
+    def __init__(self, directory, patient_data=None, bits=8, slice_spacing=1.0, count=None, queue_size=16):
+        self.directory = directory
+        self.bits = bits
+        self.slice_spacing = slice_spacing
+        self.count = count
+        # UIDs of the series are fixed here, study UID can be given in patient_data (e.g. to share it with another series)
+        self.patient_data = dict(patient_data) if patient_data is not None else {}
+        for uid in ("StudyInstanceUID", "SeriesInstanceUID", "FrameOfReferenceUID"):
+            self.patient_data[uid] = self.patient_data.get(uid) or generate_uid()
+
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    # queues slice 'index' (array of 0 - (2^bits - 1) values, it is copied, so the caller can reuse it)
+    def write(self, index, pixels):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((index, np.array(pixels, dtype=np.uint8 if self.bits <= 8 else np.uint16)))
+
+    # name of file of slice 'index'
+    def file_name(self, index):
+        return os.path.join(self.directory, f"slice_{index + 1:05d}.dcm")
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is SeriesWriter._END:
+                break
+            # after an error the queue is still emptied, so write does not block
+            if self.error is not None:
+                continue
+            try:
+                index, pixels = item
+                ds = new_dataset(self.patient_data, *pixels.shape, self.bits)
+                ds.InstanceNumber = index + 1
+                if self.count is not None:
+                    ds.ImagesInAcquisition = self.count
+                ds.ImagePositionPatient = [0.0, 0.0, index * self.slice_spacing]
+                ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+                ds.SliceLocation = index * self.slice_spacing
+                ds.SliceThickness = self.slice_spacing
+                ds.PixelSpacing = [1.0, 1.0]
+                ds.PixelData = pixel_bytes(pixels, self.bits)
+                ds.save_as(self.file_name(index), write_like_original=False)
+            except Exception as e:
+                self.error = e
+
+    # waits until all queued slices are written
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(SeriesWriter._END)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+
+# returns files of DICOM series stored in a directory, sorted by slice position (or instance number)
+def series_files(directory):
+    slices = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        try:
+            ds = pydicom.dcmread(path, stop_before_pixels=True)
+        except pydicom.errors.InvalidDicomError:
+            continue
+        if "ImagePositionPatient" in ds:
+            position = float(ds.ImagePositionPatient[2])
+        else:
+            position = float(ds.get("InstanceNumber", len(slices)))
+        slices.append((position, path))
+    return [path for position, path in sorted(slices)]
+
+
+# 8-bit image (PIL) of a DICOM frame, Radon works on 8-bit images, so other values are scaled to 0 - 255
+def frame_image(frame):
+    if frame.dtype != np.uint8:
+        frame = frame.astype(np.float64) - np.min(frame)
+        frame = np.uint8(frame / max(np.max(frame) / 255, 1e-12))
+    return Image.fromarray(frame)
+
+
+# lazy reader of DICOM series (directory with series or one, possibly multi-frame, file): only headers are read
+# when it is created, pixel data of a slice is read when the slice is accessed; slices are 8-bit PIL images,
+# ready to be used as Radon base images (reader[i], iteration, len)
+class SeriesReader:
+
+    def __init__(self, source):
+        files = series_files(source) if os.path.isdir(source) else [source]
+        # (file, frame) of every slice
+        self.slices = []
+        for path in files:
+            frames = int(pydicom.dcmread(path, stop_before_pixels=True).get("NumberOfFrames", 1))
+            self.slices.extend((path, frame) for frame in range(frames))
+        # pixel data of the last read file, so frames of a multi-frame file are read from disk once
+        self.cached_file = None
+        self.cached_pixels = None
+
+    def __len__(self):
+        return len(self.slices)
+
+    def __getitem__(self, index):
+        path, frame = self.slices[index]
+        if path != self.cached_file:
+            pixels = pydicom.dcmread(path).pixel_array
+            self.cached_pixels = pixels if pixels.ndim == 3 else pixels[None]
+            self.cached_file = path
+        return frame_image(self.cached_pixels[frame])
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
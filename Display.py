@@ -0,0 +1,49 @@
+import numpy as np
+
+# Fast preview of sinogram and reconstruction for the GUI. Matrix is sampled (nearest neighbour) directly into
+# a preallocated 8-bit buffer of display size, so a frame costs as much as the number of displayed pixels, not
+# as the size of the matrix; columns of sinogram which did not change since the last frame are not redrawn.
+
+
+# size (width, height) of displayed image of given size (width, height), fitted to display limits
+def fitSize(size, maxWidth, maxHeight):
+    if size[0] > size[1]:
+        return (maxHeight, int(maxHeight * (size[1] / size[0])) + 1)
+    return (int(maxWidth * (size[0] / size[1])) + 1, maxWidth)
+
+
+class PreviewBuffer:
+
+    # 'shape' - shape of previewed matrix (rows, columns), 'displaySize' - size of preview (width, height)
+    def __init__(self, shape, displaySize):
+        self.shape = tuple(shape)
+        self.displaySize = tuple(displaySize)
+        width, height = self.displaySize
+        self.buffer = np.zeros((height, width), dtype=np.uint8)
+
+        # matrix row and column shown in every row and column of the preview
+        self.rows = ((np.arange(height) + 0.5) * self.shape[0] / height).astype(np.intp)
+        self.columns = ((np.arange(width) + 0.5) * self.shape[1] / width).astype(np.intp)
+        self.scale = None
+
+    # draws columns from 'first' inclusive to 'last' exclusive of 'matrix' multiplied by 'scale' (values outside
+    # 0 - 255 are clipped); whole preview is redrawn when scale differs from the previous one; returns the buffer
+    def update(self, matrix, scale, first=0, last=None):
+        if last is None:
+            last = self.shape[1]
+        if scale != self.scale:
+            self.scale = scale
+            first, last = 0, self.shape[1]
+
+        a, b = np.searchsorted(self.columns, (first, last))
+        if b > a:
+            block = np.asarray(matrix[self.rows[:, None], self.columns[None, a:b]], dtype=np.float64)
+            block *= scale
+            np.clip(block, 0, 255, out=block)
+            self.buffer[:, a:b] = block
+        return self.buffer
+
+
+# scale which maps 'maximum' to 255 (0 for empty matrix)
+def scaleFor(maximum):
+    return 255 / maximum if maximum > 0 else 0.0
@@ -0,0 +1,62 @@
+import functools
+
+import numpy as np
+
+# available sinogram filters - ramp (Ram-Lak) filter multiplied by a window
+FILTER_TYPES = ('ram-lak', 'shepp-logan', 'cosine', 'hamming', 'hann')
+
+
+# smallest n' >= n which has no prime factors other than 2, 3 and 5 (fast FFT length)
+def nextFastLength(n):
+    n = max(n, 1)
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+# frequency response of filter for sinogram columns of length 'size', for use with rfft of length 'paddedSize';
+# columns are zero-padded to at least twice their length, so filtering is not affected by circular wrap-around;
+# kernels are cached, so they are computed only once for every (size, filterType)
+@functools.lru_cache(maxsize=16)
+def filterKernel(size, filterType='ram-lak'):
+    if filterType not in FILTER_TYPES:
+        raise ValueError(f"unknown filter type '{filterType}', available: {', '.join(FILTER_TYPES)}")
+    paddedSize = nextFastLength(2 * size)
+
+    # spatial domain ramp filter: 1/4 at zero, -1/(pi*n)^2 at odd distances n and 0 at even distances
+    distance = np.arange(paddedSize)
+    distance = np.minimum(distance, paddedSize - distance)
+    f = np.zeros(paddedSize)
+    f[0] = 0.25
+    odd = distance % 2 == 1
+    f[odd] = -1 / (np.pi * distance[odd]) ** 2
+    response = 2 * np.real(np.fft.rfft(f))
+
+    # frequency in cycles per sample (0 - 0.5)
+    freq = np.fft.rfftfreq(paddedSize)
+    if filterType == 'shepp-logan':
+        response *= np.sinc(freq)
+    elif filterType == 'cosine':
+        response *= np.cos(np.pi * freq)
+    elif filterType == 'hamming':
+        response *= 0.54 + 0.46 * np.cos(2 * np.pi * freq)
+    elif filterType == 'hann':
+        response *= 0.5 + 0.5 * np.cos(2 * np.pi * freq)
+
+    response.setflags(write=False)
+    return response, paddedSize
+
+
+# filters all columns of sinogram (detectors along axis 0) at once
+def filterSinogram(sinogram, filterType='ram-lak'):
+    size = sinogram.shape[0]
+    response, paddedSize = filterKernel(size, filterType)
+
+    spectrum = np.fft.rfft(sinogram, n=paddedSize, axis=0)
+    spectrum *= response[:, None]
+    return np.fft.irfft(spectrum, n=paddedSize, axis=0)[:size]
@@ -0,0 +1,321 @@
+import functools
+import hashlib
+
+import numpy as np
+
+import Instrumentation
+import Projectors
+
+
+# Precomputed ray geometry of a scan. All rays of all iterations are rasterized once and stored as a sparse
+# projection matrix in CSR layout: ray r (r = iteration * numberOfEmitters + emitter) crosses pixels
+# indices[indptr[r]:indptr[r + 1]] (flat indices into the image) with weights weights[indptr[r]:indptr[r + 1]]
+# (weights is None when every pixel counts as 1). Rays are turned into pixels by a projector (see Projectors.PROJECTORS).
+# An already computed matrix (indptr, indices, weights) can be passed as 'matrix', e.g. arrays in shared memory.
+# ScanGeometry is the original scanner of the simulator ('arc' beam): emitters spread over emittersAngularSpan,
+# detectors mirrored at +pi; rays of one iteration are parallel, but not evenly spaced. Other beams are subclasses,
+# see BEAMS.
+class ScanGeometry:
+
+    beam = 'arc'
+    # scanner rotates over this angle, one iteration every rotationDelta
+    angularRange = np.pi
+
+    def __init__(self, shape, startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta, projector='bresenham',
+                 matrix=None):
+        self.shape = tuple(shape)
+        self.startRotation = startRotation
+        self.numberOfEmitters = numberOfEmitters
+        self.emittersAngularSpan = emittersAngularSpan
+        self.rotationDelta = rotationDelta
+        self.projector = projector
+
+        self.numberOfIterations = int(self.angularRange / rotationDelta)
+        self.numberOfRays = self.numberOfEmitters * self.numberOfIterations
+
+        # scanner is a circle around the image with radius of half of image diagonal
+        self.center = (self.shape[0] / 2, self.shape[1] / 2)
+        self.radius = np.sqrt((self.shape[0] * self.shape[0]) + (self.shape[1] * self.shape[1])) / 2
+
+        if matrix is None:
+            matrix = self.buildMatrix()
+        self.indptr, self.indices, self.weights = matrix
+
+        # detector positions for pixel-driven backprojection, computed on first use
+        self.normals = None
+        self.offsets = None
+
+    # parameters which fully determine the geometry (arguments of createGeometry)
+    @property
+    def key(self):
+        return (self.shape, self.startRotation, self.numberOfEmitters, self.emittersAngularSpan, self.rotationDelta,
+                self.projector, self.beam)
+
+    # short hash of key, identifies geometry in saved files
+    @property
+    def hash(self):
+        return geometryHash(*self.key)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    # positions of emitter (x0, y0) and detector (x1, y1) of every ray, in ray order
+    def rayEndpoints(self):
+        halfOfSpan = self.emittersAngularSpan / 2
+        angleGapBetweenSensors = self.emittersAngularSpan / (self.numberOfEmitters - 1)
+
+        # rotation of the first emitter in every iteration
+        initRotation = self.iterationAngles() - halfOfSpan
+        emitters = np.arange(self.numberOfEmitters)
+
+        # emitter i is paired with detector numberOfEmitters - 1 - i, detectors are mirrored at +pi
+        emitterRotation = initRotation[:, None] + emitters[None, :] * angleGapBetweenSensors
+        detectorRotation = initRotation[:, None] + emitters[None, ::-1] * angleGapBetweenSensors + np.pi
+
+        x0 = self.radius * np.cos(emitterRotation) + self.center[0]
+        y0 = self.radius * np.sin(emitterRotation) + self.center[1]
+        x1 = self.radius * np.cos(detectorRotation) + self.center[0]
+        y1 = self.radius * np.sin(detectorRotation) + self.center[1]
+
+        return x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel()
+
+    def buildMatrix(self):
+        if self.projector not in Projectors.PROJECTORS:
+            raise ValueError(f"unknown projector '{self.projector}', available: {', '.join(Projectors.PROJECTORS)}")
+        with Instrumentation.phase('rayGeneration'):
+            endpoints = self.rayEndpoints()
+        with Instrumentation.phase('rasterization'):
+            matrix = Projectors.PROJECTORS[self.projector](*endpoints, self.shape)
+        Instrumentation.count('rasterizedRays', self.numberOfRays)
+        Instrumentation.count('rasterizedPixels', matrix[0][-1])
+        return matrix
+
+    # rotation of the scanner in every iteration (scanner is rotated by rotationDelta before each measurement)
+    def iterationAngles(self):
+        return self.startRotation + (np.arange(self.numberOfIterations) + 1) * self.rotationDelta
+
+    # rays of one iteration are parallel; returns unit normal of rays of every iteration (iterations x 2) and signed
+    # distance of every ray from the scanner center along that normal (iterations x emitters)
+    def detectorPositions(self):
+        if self.normals is None:
+            x0, y0, x1, y1 = (a.reshape(self.numberOfIterations, self.numberOfEmitters) for a in self.rayEndpoints())
+            dx = np.sum(x1 - x0, axis=1)
+            dy = np.sum(y1 - y0, axis=1)
+            length = np.hypot(dx, dy)
+            self.normals = np.stack((-dy / length, dx / length), axis=1)
+            self.offsets = (x0 - self.center[0]) * self.normals[:, 0:1] + (y0 - self.center[1]) * self.normals[:, 1:2]
+        return self.normals, self.offsets
+
+    # range of matrix rows belonging to iterations from 'from_iteration' inclusive to 'to_iteration' exclusive
+    def rowRange(self, from_iteration, to_iteration):
+        return from_iteration * self.numberOfEmitters, to_iteration * self.numberOfEmitters
+
+    # forward projection (sparse mat-vec): sums of imageArray along rays of the given iterations, accumulated
+    # in 'dtype' and returned as sinogram columns of shape (numberOfEmitters, to_iteration - from_iteration)
+    def project(self, imageArray, from_iteration=0, to_iteration=None, dtype=np.float64):
+        if to_iteration is None:
+            to_iteration = self.numberOfIterations
+        firstRay, lastRay = self.rowRange(from_iteration, to_iteration)
+        start, end = self.indptr[firstRay], self.indptr[lastRay]
+
+        with Instrumentation.phase('pixelSummation'):
+            values = np.asarray(imageArray).ravel()[self.indices[start:end]].astype(dtype)
+            if self.weights is not None:
+                values *= self.weights[start:end]
+
+            sums = segmentSums(values, self.indptr[firstRay:lastRay + 1] - start)
+        Instrumentation.count('projectedRays', lastRay - firstRay)
+        Instrumentation.count('projectedPixels', end - start)
+        return sums.reshape(to_iteration - from_iteration, self.numberOfEmitters).T
+
+    # backprojection (transposed sparse mat-vec): smears sinogram values of the given iterations along their rays
+    # and adds them to 'out' (a new zero image is created if 'out' is None), values are smeared in the type of 'out'
+    def backproject(self, sinogram, from_iteration=0, to_iteration=None, out=None):
+        if to_iteration is None:
+            to_iteration = self.numberOfIterations
+        return self.backprojectColumns(np.asarray(sinogram)[:, from_iteration:to_iteration], from_iteration, out)
+
+    # same as backproject, but 'columns' holds only sinogram columns of iterations starting at 'from_iteration'
+    def backprojectColumns(self, columns, from_iteration, out=None):
+        if out is None:
+            out = np.zeros(self.shape)
+        firstRay, lastRay = self.rowRange(from_iteration, from_iteration + columns.shape[1])
+        start, end = self.indptr[firstRay], self.indptr[lastRay]
+
+        with Instrumentation.phase('backprojection'):
+            # few rays (e.g. one iteration) touch only a small part of the image, so they are added in place (in the
+            # type of 'out'); many rays are accumulated with bincount, which is faster but always builds a full image
+            # and works only in float64
+            inPlace = end - start < out.size // 8
+            rayValues = np.asarray(columns, dtype=out.dtype if inPlace else np.float64).T.ravel()
+            values = np.repeat(rayValues, np.diff(self.indptr[firstRay:lastRay + 1]))
+            if self.weights is not None:
+                values *= self.weights[start:end]
+
+            if inPlace:
+                np.add.at(out.reshape(-1), self.indices[start:end], values)
+            else:
+                out += np.bincount(self.indices[start:end], weights=values, minlength=out.size).reshape(out.shape)
+        Instrumentation.count('backprojectedRays', lastRay - firstRay)
+        Instrumentation.count('backprojectedPixels', end - start)
+        return out
+
+
+    # pixel-driven backprojection: for every iteration, detector coordinate of every pixel center is computed at once
+    # and the sinogram column is linearly interpolated there; columns are first resampled on a uniform grid of
+    # detector positions (spacing 'gridStep' pixels), so interpolation for pixels is a plain gather without searching;
+    # iterations are processed in blocks of at most 'blockElements' pixel samples to bound memory,
+    # values are added to 'out' (a new zero image if 'out' is None)
+    def backprojectPixels(self, sinogram, from_iteration=0, to_iteration=None, out=None, blockElements=1 << 22, gridStep=0.5):
+        if to_iteration is None:
+            to_iteration = self.numberOfIterations
+        return self.backprojectPixelColumns(np.asarray(sinogram)[:, from_iteration:to_iteration], from_iteration, out,
+                                            blockElements, gridStep)
+
+    # same as backprojectPixels, but 'columns' holds only sinogram columns of iterations starting at 'from_iteration'
+    def backprojectPixelColumns(self, columns, from_iteration, out=None, blockElements=1 << 22, gridStep=0.5):
+        if out is None:
+            out = np.zeros(self.shape)
+        with Instrumentation.phase('backprojection'):
+            self.backprojectPixelBlocks(columns, from_iteration, out, blockElements, gridStep)
+        Instrumentation.count('backprojectedRays', columns.shape[0] * columns.shape[1])
+        Instrumentation.count('backprojectedPixels', columns.shape[1] * self.shape[0] * self.shape[1])
+        return out
+
+    def backprojectPixelBlocks(self, columns, from_iteration, out, blockElements, gridStep):
+        to_iteration = from_iteration + columns.shape[1]
+        normals, offsets = self.detectorPositions()
+        columns = np.asarray(columns, dtype=np.float64)
+
+        # pixel centers relative to scanner center
+        x = np.arange(self.shape[0]) + 0.5 - self.center[0]
+        y = np.arange(self.shape[1]) + 0.5 - self.center[1]
+
+        # grid covers whole scanner, all pixel positions fall inside it
+        grid = np.arange(-self.radius - gridStep, self.radius + 2 * gridStep, gridStep)
+        blockSize = max(1, blockElements // out.size)
+        for first in range(from_iteration, to_iteration, blockSize):
+            last = min(first + blockSize, to_iteration)
+
+            # resampled columns and slopes between grid points, rows of a block are stored one after another
+            table = np.zeros((last - first, len(grid)))
+            for k in range(first, last):
+                order = np.argsort(offsets[k])
+                table[k - first] = np.interp(grid, offsets[k][order], columns[order, k - from_iteration], left=0, right=0)
+            slope = np.zeros_like(table)
+            slope[:, :-1] = np.diff(table, axis=1)
+            table = table.ravel()
+            slope = slope.ravel()
+
+            # position of pixel on the grid is a sum of separate x and y terms
+            xTerm = normals[first:last, 0:1] * x[None, :] / gridStep
+            yTerm = (normals[first:last, 1:2] * y[None, :] - grid[0]) / gridStep + (np.arange(last - first) * len(grid))[:, None]
+            u = xTerm[:, :, None] + yTerm[:, None, :]
+
+            index = u.astype(np.intp)
+            u -= index
+            out += np.sum(table[index] + u * slope[index], axis=0)
+        return out
+
+
+# parallel beam with evenly spaced rays: in every iteration numberOfEmitters parallel rays, perpendicular to
+# the scanner direction, cover the same band as rays of ScanGeometry (width 2 * radius * sin(emittersAngularSpan / 2))
+class ParallelBeamGeometry(ScanGeometry):
+
+    beam = 'parallel'
+
+    # signed distances of rays from the scanner center
+    def detectorOffsets(self):
+        return self.radius * np.sin(self.emittersAngularSpan / 2) * np.linspace(-1, 1, self.numberOfEmitters)
+
+    def rayEndpoints(self):
+        angles = self.iterationAngles()[:, None]
+        offsets = self.detectorOffsets()[None, :]
+        # unit vectors along the rays (from emitter side to detector side) and across them
+        along = (-np.cos(angles), -np.sin(angles))
+        across = (-np.sin(angles), np.cos(angles))
+        halfChord = np.sqrt(np.maximum(self.radius * self.radius - offsets * offsets, 0))
+
+        mx = self.center[0] + offsets * across[0]
+        my = self.center[1] + offsets * across[1]
+        x0 = mx - halfChord * along[0]
+        y0 = my - halfChord * along[1]
+        x1 = mx + halfChord * along[0]
+        y1 = my + halfChord * along[1]
+
+        return x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel()
+
+
+# fan beam: single source on the scanner circle and an arc of numberOfEmitters detectors on the opposite side,
+# rays spread evenly over fan angle emittersAngularSpan (which must be smaller than pi); source goes around
+# the whole circle, so there are 2 * pi / rotationDelta iterations
+class FanBeamGeometry(ScanGeometry):
+
+    beam = 'fan'
+    angularRange = 2 * np.pi
+
+    # angle of every ray from the line through the source and the scanner center
+    def fanAngles(self):
+        return np.linspace(-self.emittersAngularSpan / 2, self.emittersAngularSpan / 2, self.numberOfEmitters)
+
+    def rayEndpoints(self):
+        sources = self.iterationAngles()[:, None]
+        # chord leaving the source at fan angle g ends on the circle at angle source + pi + 2 * g
+        detectors = sources + np.pi + 2 * self.fanAngles()[None, :]
+        sources = np.broadcast_to(sources, detectors.shape)
+
+        x0 = self.radius * np.cos(sources) + self.center[0]
+        y0 = self.radius * np.sin(sources) + self.center[1]
+        x1 = self.radius * np.cos(detectors) + self.center[0]
+        y1 = self.radius * np.sin(detectors) + self.center[1]
+
+        return x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel()
+
+    def detectorPositions(self):
+        raise ValueError("rays of fan beam are not parallel, rebin sinogram to parallel beam first (see Rebinning)")
+
+
+# available beam geometries by name
+BEAMS = {
+    'arc': ScanGeometry,
+    'parallel': ParallelBeamGeometry,
+    'fan': FanBeamGeometry,
+}
+
+
+def createGeometry(shape, startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta, projector='bresenham',
+                   beam='arc', matrix=None):
+    if beam not in BEAMS:
+        raise ValueError(f"unknown beam '{beam}', available: {', '.join(BEAMS)}")
+    return BEAMS[beam](shape, startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta, projector, matrix)
+
+
+# number of iterations (projections) of a scan with given beam and rotation delta
+def iterationCount(beam, rotationDelta):
+    return int(BEAMS[beam].angularRange / rotationDelta)
+
+
+# sums of values[offsets[i]:offsets[i + 1]] for every i, computed with a single reduceat
+def segmentSums(values, offsets):
+    # reduceat needs valid start indices, so a trailing zero is appended and empty segments are cleared afterwards
+    sums = np.add.reduceat(np.append(values, values.dtype.type(0)), offsets[:-1])
+    sums[offsets[1:] == offsets[:-1]] = 0
+    return sums
+
+
+# hash of scan parameters which determine the geometry (the same for equal parameters in every process and session)
+def geometryHash(shape, startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta, projector='bresenham',
+                 beam='arc'):
+    key = (tuple(int(s) for s in shape), float(startRotation), int(numberOfEmitters), float(emittersAngularSpan),
+           float(rotationDelta), str(projector))
+    # beam is a later addition, hashes of the original scanner stay the same
+    if beam != 'arc':
+        key += (str(beam),)
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+
+# returns geometry for given scan parameters, geometries are computed once and reused for the same parameters
+@functools.lru_cache(maxsize=8)
+def getGeometry(shape, startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta, projector='bresenham', beam='arc'):
+    return createGeometry(shape, startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta, projector, beam)
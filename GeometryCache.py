@@ -0,0 +1,199 @@
+import collections
+import os
+import shutil
+import uuid
+import weakref
+
+import numpy as np
+
+import Geometry
+
+# On-disk cache of ray geometries shared by all processes using the same cache directory. Every geometry is kept
+# in its own subdirectory named by the hash of its parameters (see Geometry.geometryHash), with arrays of its
+# matrix saved as .npy files, so they are loaded memory-mapped (pages are shared by all processes, nothing is copied).
+# Least recently used entries are removed when size of the cache exceeds its limit. Entries used by a live process
+# are pinned (empty file 'pin-<pid>' in the entry, removed when the geometry is not used anymore) and never removed,
+# as its worker processes map their files. Geometries reused in memory are dropped when the limit cannot be kept
+# otherwise, so only geometries really used keep their entries over the limit.
+
+# version of the cache layout and of the matrix format, entries of other versions are not used
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 2 << 30
+
+MATRIX_ARRAYS = ('indptr', 'indices', 'weights')
+
+# number of geometries reused in memory (see cachedGeometry)
+MEMORY_CACHE_SIZE = 8
+
+
+# number of geometries of this process using every pinned entry, by pin file
+_pins = {}
+
+# geometries reused in memory by (directory, key), least recently used first
+_geometries = collections.OrderedDict()
+
+
+def entryPath(directory, key):
+    return os.path.join(directory, f'{Geometry.geometryHash(*key)}-v{CACHE_VERSION}')
+
+
+def pinPath(path):
+    return os.path.join(path, f'pin-{os.getpid()}')
+
+
+# pins entry for this process, returns pin file (see unpinEntry)
+def pinEntry(path):
+    pin = pinPath(path)
+    if pin not in _pins:
+        open(pin, 'a').close()
+        _pins[pin] = 0
+    _pins[pin] += 1
+    return pin
+
+
+def unpinEntry(pin):
+    _pins[pin] -= 1
+    if _pins[pin] == 0:
+        del _pins[pin]
+        try:
+            os.remove(pin)
+        except OSError:
+            pass
+
+
+def processExists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# True if entry is pinned by a live process; pins of processes which died without removing them are ignored
+def isPinned(path):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith('pin-') and processExists(int(entry.name[4:])):
+                return True
+    return False
+
+
+# geometry with matrix memory-mapped from cache entry, None if there is no such entry
+def loadEntry(directory, key):
+    path = entryPath(directory, key)
+    if not os.path.isdir(path):
+        return None
+    try:
+        # entry is pinned before its files are mapped, so it cannot be removed in the meantime
+        pin = pinEntry(path)
+    except OSError:
+        return None
+    try:
+        matrix = tuple(np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                       if os.path.exists(os.path.join(path, name + '.npy')) else None for name in MATRIX_ARRAYS)
+    except (OSError, ValueError):
+        # entry removed by another process in the meantime or damaged
+        matrix = (None, None, None)
+    if matrix[0] is None or matrix[1] is None:
+        unpinEntry(pin)
+        return None
+    geometry = Geometry.createGeometry(*key, matrix=matrix)
+    # entry stays pinned as long as the geometry is used
+    weakref.finalize(geometry, unpinEntry, pin)
+    touchEntry(path)
+    return geometry
+
+
+# modification time of the entry is its last use (for LRU eviction)
+def touchEntry(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# saves matrix of the geometry as a new entry; entry is written to a temporary directory and renamed,
+# so other processes never see partially written entries
+def storeEntry(directory, key, geometry):
+    os.makedirs(directory, exist_ok=True)
+    path = entryPath(directory, key)
+    temporaryPath = f'{path}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(temporaryPath)
+    for name, array in zip(MATRIX_ARRAYS, (geometry.indptr, geometry.indices, geometry.weights)):
+        if array is not None:
+            np.save(os.path.join(temporaryPath, name + '.npy'), array)
+    with open(os.path.join(temporaryPath, 'key.txt'), 'w') as keyFile:
+        keyFile.write(repr(key))
+    try:
+        os.rename(temporaryPath, path)
+    except OSError:
+        # the same entry was stored by another process
+        shutil.rmtree(temporaryPath, ignore_errors=True)
+
+
+def entrySize(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+# removes least recently used entries until size of the cache is at most 'maxBytes', entry 'keep'
+# and entries pinned by live processes are never removed; returns size of the cache left
+def evict(directory, maxBytes, keep=None):
+    entries = []
+    with os.scandir(directory) as directoryEntries:
+        for entry in directoryEntries:
+            if entry.is_dir() and '.tmp-' not in entry.name:
+                try:
+                    entries.append((entry.stat().st_mtime, entrySize(entry.path), entry.path))
+                except OSError:
+                    pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        try:
+            if path == keep or isPinned(path):
+                continue
+        except OSError:
+            # entry removed by another process in the meantime
+            total -= size
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+    return total
+
+
+# returns geometry for given scan parameters from cache in 'directory', geometry is computed and stored
+# in the cache only if it is not there; geometries are also reused in memory like in Geometry.getGeometry,
+# use of a geometry reused in memory refreshes its entry too
+def getGeometry(directory, shape, startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta,
+                projector='bresenham', maxBytes=DEFAULT_MAX_BYTES, beam='arc'):
+    key = (tuple(shape), startRotation, numberOfEmitters, emittersAngularSpan, rotationDelta, projector, beam)
+    geometry = cachedGeometry(directory, key, maxBytes)
+    touchEntry(entryPath(directory, key))
+    return geometry
+
+
+# geometry reused in memory (at most MEMORY_CACHE_SIZE least recently used ones) or loaded from the cache;
+# geometries reused in memory keep their entries pinned, so when the cache is over its limit, other geometries
+# of the directory are dropped from memory (entries of those not used anymore are unpinned) and evicted
+def cachedGeometry(directory, key, maxBytes):
+    geometry = _geometries.pop((directory, key), None)
+    if geometry is None:
+        geometry = loadEntry(directory, key)
+    if geometry is None:
+        geometry = Geometry.createGeometry(*key)
+        storeEntry(directory, key, geometry)
+        path = entryPath(directory, key)
+        if evict(directory, maxBytes, keep=path) > maxBytes:
+            for cached in [cached for cached in _geometries if cached[0] == directory]:
+                del _geometries[cached]
+            evict(directory, maxBytes, keep=path)
+        # memory-mapped arrays are used instead of the computed ones, so they can be shared with worker processes
+        geometry = loadEntry(directory, key) or geometry
+    _geometries[(directory, key)] = geometry
+    while len(_geometries) > MEMORY_CACHE_SIZE:
+        _geometries.popitem(last=False)
+    return geometry
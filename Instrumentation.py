@@ -0,0 +1,95 @@
+import contextlib
+import threading
+import time
+
+# Opt-in instrumentation of computations: timers of phases (total time and number of calls) and counters
+# (e.g. rays and pixels touched). Code of phases calls module functions phase() and count(), which do nothing
+# unless an Instrumentation object is activated in the current thread (see Instrumentation.activate),
+# so disabled instrumentation costs one attribute lookup per call.
+
+# context returned when instrumentation is disabled
+DISABLED = contextlib.nullcontext()
+
+# instrumentation activated in the current thread
+_state = threading.local()
+
+
+class Instrumentation:
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        # hook(kind, name, value) is called after every recorded phase ('timer', name, seconds)
+        # and counter update ('counter', name, added value), e.g. to export metrics
+        self.hooks = []
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+
+    def addHook(self, hook):
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        self.hooks.remove(hook)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        s_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - s_time)
+
+    def record(self, name, elapsed):
+        timer = self.timers.setdefault(name, [0, 0.0])
+        timer[0] += 1
+        timer[1] += elapsed
+        for hook in self.hooks:
+            hook('timer', name, elapsed)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+        for hook in self.hooks:
+            hook('counter', name, value)
+
+    # makes this instrumentation the one used by phase() and count() in the current thread
+    @contextlib.contextmanager
+    def activate(self):
+        previous = getattr(_state, 'active', None)
+        _state.active = self
+        try:
+            yield self
+        finally:
+            _state.active = previous
+
+    # timers and counters as a dict: {'timers': {name: {'calls', 'total_s', 'mean_s'}}, 'counters': {name: value}}
+    def report(self):
+        timers = {name: {'calls': calls, 'total_s': total, 'mean_s': total / calls}
+                  for name, (calls, total) in self.timers.items()}
+        return {'timers': timers, 'counters': dict(self.counters)}
+
+    # report as text, phases sorted by total time
+    def formatReport(self):
+        lines = []
+        for name, timer in sorted(self.report()['timers'].items(), key=lambda item: -item[1]['total_s']):
+            lines.append(f"{name:<20} {timer['total_s']:10.4f} s {timer['calls']:8d} calls")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<20} {value:12d}")
+        return '\n'.join(lines)
+
+
+# times the enclosed block as phase 'name' of the active instrumentation
+def phase(name):
+    active = getattr(_state, 'active', None)
+    return DISABLED if active is None else active.phase(name)
+
+
+def count(name, value=1):
+    active = getattr(_state, 'active', None)
+    if active is not None:
+        active.count(name, value)
+
+
+def isActive():
+    return getattr(_state, 'active', None) is not None
@@ -0,0 +1,138 @@
+from PIL import Image
+import numpy as np
+
+from Geometry import segmentSums
+import Metrics
+
+# iterative reconstruction methods:
+# sirt - all rays update the image at once, x += relaxation * C^-1 A^T R^-1 (b - A x)
+# sart - the same update, but done for one subset of angles at a time (ordered subsets)
+# osem - ordered subsets expectation maximization, x *= A^T (b / A x) / A^T 1 for one subset at a time
+METHODS = ('sirt', 'sart', 'osem')
+
+
+# rows of ray/pixel matrix which belong to a subset of iterations (angles) of a scan, with measured sinogram values
+class Subset:
+
+    def __init__(self, geometry, iterations, sinogram):
+        rows = (iterations[:, None] * geometry.numberOfEmitters + np.arange(geometry.numberOfEmitters)[None, :]).ravel()
+        starts = geometry.indptr[rows]
+        counts = geometry.indptr[rows + 1] - starts
+
+        self.shape = geometry.shape
+        self.indptr = np.zeros(len(rows) + 1, dtype=np.intp)
+        np.cumsum(counts, out=self.indptr[1:])
+        # positions of all nonzeros of selected rows in the full matrix
+        positions = np.repeat(starts - self.indptr[:-1], counts) + np.arange(self.indptr[-1])
+        self.indices = geometry.indices[positions]
+        self.weights = np.ones(len(positions)) if geometry.weights is None else geometry.weights[positions]
+
+        self.measured = np.asarray(sinogram, dtype=np.float64)[:, iterations].T.ravel()
+        self.rowSums = segmentSums(self.weights, self.indptr)
+        self.columnSums = self.backproject(np.ones(len(rows)))
+
+    def project(self, image):
+        return segmentSums(image.ravel()[self.indices] * self.weights, self.indptr)
+
+    def backproject(self, values):
+        values = np.repeat(values, np.diff(self.indptr)) * self.weights
+        return np.bincount(self.indices, weights=values, minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+
+
+# 1 / a where a != 0, 0 elsewhere
+def safeInverse(a):
+    inverse = np.zeros_like(a, dtype=np.float64)
+    np.divide(1, a, out=inverse, where=a != 0)
+    return inverse
+
+
+# iterative reconstruction from sinogram of a Radon object (its raw sinogram 'radonmatrix' must be generated);
+# state (current image and currentIteration) is kept, so computation can be continued with further
+# nextIteration/run calls; after every iteration the image is also stored in radon.reconstrImage, so it
+# can be read with radon.getReconstruction()
+class IterativeSolver:
+
+    def __init__(self, radon, method='sirt', numberOfSubsets=None, relaxation=1.0, nonNegative=True,
+                 tolerance=1e-4, maxIterations=50, trackRMSE=True, stopOnRMSEIncrease=False):
+        if method not in METHODS:
+            raise ValueError(f"unknown method '{method}', available: {', '.join(METHODS)}")
+        self.radon = radon
+        self.method = method
+        self.relaxation = relaxation
+        self.nonNegative = nonNegative
+        self.tolerance = tolerance
+        self.maxIterations = maxIterations
+        self.trackRMSE = trackRMSE or stopOnRMSEIncrease
+        # early stopping at the point of semi-convergence (RMSE against base image starts to grow)
+        self.stopOnRMSEIncrease = stopOnRMSEIncrease
+
+        # sirt uses all angles at once, sart and osem by default use subsets of about 10 angles
+        if numberOfSubsets is None:
+            numberOfSubsets = 1 if method == 'sirt' else max(1, radon.numberOfIterations // 10)
+        self.numberOfSubsets = min(numberOfSubsets, radon.numberOfIterations)
+
+        # subsets are interleaved (subset s holds angles s, s + numberOfSubsets, ...), so every subset covers whole scan
+        geometry = radon.getGeometry()
+        self.subsets = [Subset(geometry, np.arange(s, radon.numberOfIterations, self.numberOfSubsets), radon.radonmatrix)
+                        for s in range(self.numberOfSubsets)]
+
+        self.reset()
+
+    def reset(self):
+        self.currentIteration = 0
+        self.converged = False
+        # osem needs positive starting image, additive methods start from zeros
+        if self.method == 'osem':
+            self.image = np.ones(self.radon.reconstrImage.shape)
+        else:
+            self.image = np.zeros(self.radon.reconstrImage.shape)
+        # relative change of the image and RMSE against base image after every iteration
+        self.updateHistory = []
+        self.rmseHistory = []
+
+    # one iteration (pass over all subsets), returns relative change of the image
+    def iterate(self):
+        previous = self.image.copy()
+        for subset in self.subsets:
+            if self.method == 'osem':
+                ratio = subset.measured * safeInverse(subset.project(self.image))
+                self.image *= subset.backproject(ratio) * safeInverse(subset.columnSums)
+            else:
+                residual = (subset.measured - subset.project(self.image)) * safeInverse(subset.rowSums)
+                self.image += self.relaxation * subset.backproject(residual) * safeInverse(subset.columnSums)
+                if self.nonNegative:
+                    np.maximum(self.image, 0, out=self.image)
+
+        norm = np.linalg.norm(self.image)
+        return np.linalg.norm(self.image - previous) / norm if norm > 0 else 0.0
+
+    def getRMSE(self):
+        return Metrics.rmse(self.image, self.radon.baseImageArray)
+
+    # computes next 'count' iterations (fewer if converged or maxIterations reached), returns number of computed iterations
+    def nextIteration(self, count=1):
+        done = 0
+        while done < count and not self.converged and self.currentIteration < self.maxIterations:
+            change = self.iterate()
+            self.currentIteration += 1
+            done += 1
+
+            self.updateHistory.append(change)
+            if self.trackRMSE:
+                self.rmseHistory.append(self.getRMSE())
+            if change < self.tolerance:
+                self.converged = True
+            if self.stopOnRMSEIncrease and len(self.rmseHistory) > 1 and self.rmseHistory[-1] > self.rmseHistory[-2]:
+                self.converged = True
+
+        self.radon.reconstrImage[...] = self.image
+        return done
+
+    # iterates until convergence or maxIterations
+    def run(self):
+        while self.nextIteration(count=self.maxIterations) > 0:
+            pass
+        return self.image
+
+    def getReconstruction(self):
+        return Image.fromarray(self.image / (np.max(self.image) / 255))
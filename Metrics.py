@@ -0,0 +1,103 @@
+import numpy as np
+
+# Image quality metrics of reconstruction against reference (base) image. Images are compared as float arrays
+# of the same shape, values are expected in 0 - 'dataRange' (0 - 255 for normalized reconstructions).
+
+METRICS = ('rmse', 'mae', 'psnr', 'ssim')
+
+
+def checkShapes(image, reference):
+    if np.shape(image) != np.shape(reference):
+        raise ValueError(f"images have different shapes {np.shape(image)} and {np.shape(reference)}")
+
+
+def rmse(image, reference):
+    checkShapes(image, reference)
+    difference = np.asarray(image, dtype=np.float64) - reference
+    return float(np.sqrt(np.mean(difference * difference)))
+
+
+def mae(image, reference):
+    checkShapes(image, reference)
+    return float(np.mean(np.abs(np.asarray(image, dtype=np.float64) - reference)))
+
+
+# peak signal to noise ratio in dB (infinity for identical images)
+def psnr(image, reference, dataRange=255):
+    error = rmse(image, reference)
+    return float('inf') if error == 0 else float(20 * np.log10(dataRange / error))
+
+
+# sums of all windowSize x windowSize windows which fit in the image, computed with an integral image
+def windowSums(image, windowSize):
+    integral = np.zeros((image.shape[0] + 1, image.shape[1] + 1))
+    np.cumsum(np.cumsum(image, axis=0), axis=1, out=integral[1:, 1:])
+    w = windowSize
+    return integral[w:, w:] - integral[:-w, w:] - integral[w:, :-w] + integral[:-w, :-w]
+
+
+# mean structural similarity over all windowSize x windowSize windows (uniform weights, sample covariance)
+def ssim(image, reference, dataRange=255, windowSize=7):
+    checkShapes(image, reference)
+    x = np.asarray(image, dtype=np.float64)
+    y = np.asarray(reference, dtype=np.float64)
+    windowSize = min(windowSize, *x.shape)
+    n = windowSize * windowSize
+
+    mx = windowSums(x, windowSize) / n
+    my = windowSums(y, windowSize) / n
+    covarianceNorm = n / (n - 1) if n > 1 else 1
+    vx = (windowSums(x * x, windowSize) / n - mx * mx) * covarianceNorm
+    vy = (windowSums(y * y, windowSize) / n - my * my) * covarianceNorm
+    vxy = (windowSums(x * y, windowSize) / n - mx * my) * covarianceNorm
+
+    c1 = (0.01 * dataRange) ** 2
+    c2 = (0.03 * dataRange) ** 2
+    s = ((2 * mx * my + c1) * (2 * vxy + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+    return float(np.mean(s))
+
+
+# all metrics as a dict
+def computeMetrics(image, reference, dataRange=255):
+    return {'rmse': rmse(image, reference), 'mae': mae(image, reference), 'psnr': psnr(image, reference, dataRange),
+            'ssim': ssim(image, reference, dataRange)}
+
+
+# cheap tracking of RMSE, MAE and PSNR after every iteration: metrics are computed on a fixed random sample of
+# 'samples' pixels (all pixels when 'samples' is None), so one update costs O(samples) plus the maximum of the image
+# needed for normalization; history holds (iteration, metrics) pairs
+class MetricsTracker:
+
+    def __init__(self, reference, samples=4096, dataRange=255, seed=0):
+        self.dataRange = dataRange
+        self.samples = samples
+        self.seed = seed
+        self.reset(reference)
+
+    def reset(self, reference=None):
+        if reference is not None:
+            self.reference = np.asarray(reference, dtype=np.float64)
+            size = self.reference.size
+            if self.samples is None or self.samples >= size:
+                self.pixels = np.arange(size)
+            else:
+                self.pixels = np.sort(np.random.default_rng(self.seed).choice(size, self.samples, replace=False))
+            self.referenceSamples = self.reference.ravel()[self.pixels]
+        self.history = []
+
+    # records metrics of 'image' normalized to 0 - dataRange (raw reconstruction can be passed, it is
+    # normalized by its maximum) after 'iteration'; returns the metrics
+    def update(self, iteration, image, normalize=True):
+        image = np.asarray(image)
+        values = image.ravel()[self.pixels].astype(np.float64)
+        if normalize:
+            maximum = np.max(image)
+            values *= self.dataRange / maximum if maximum > 0 else 0
+        metrics = {'rmse': rmse(values, self.referenceSamples), 'mae': mae(values, self.referenceSamples),
+                   'psnr': psnr(values, self.referenceSamples, self.dataRange)}
+        self.history.append((iteration, metrics))
+        return metrics
+
+    # values of one metric over iterations, as two lists (iterations, values)
+    def curve(self, metric='rmse'):
+        return [i for i, _ in self.history], [m[metric] for _, m in self.history]
@@ -0,0 +1,213 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import weakref
+
+import numpy as np
+
+from Geometry import createGeometry
+
+
+# numpy array placed in shared memory, workers attach to it by its descriptor instead of receiving a pickled copy;
+# shared memory is released when the object is garbage collected or closed
+class SharedArray:
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf)
+        self.array[...] = array
+        self.descriptor = (self.shm.name, array.shape, array.dtype.str)
+        self._finalizer = weakref.finalize(self, SharedArray._release, self.shm)
+
+    @staticmethod
+    def _release(shm):
+        shm.close()
+        shm.unlink()
+
+    def close(self):
+        self.array = None
+        self._finalizer()
+
+
+# numpy array memory-mapped from .npy file (e.g. geometry from GeometryCache), workers map the same file
+# instead of copying it to shared memory
+class MappedArray:
+
+    def __init__(self, array):
+        self.array = array
+        self.descriptor = (array.filename,)
+
+    def close(self):
+        self.array = None
+
+
+# shared memory blocks and memory-mapped files attached in the current (worker) process, by name
+_attached = {}
+
+# geometries rebuilt from shared arrays in the current (worker) process, by descriptors of their arrays
+_geometries = {}
+
+
+# returns array described by 'descriptor' (see SharedArray) without copying it;
+# workers share resource tracker of the owner, so the block is unlinked only by the owner
+def attach(descriptor):
+    if descriptor is None:
+        return None
+    if len(descriptor) == 1:
+        if descriptor[0] not in _attached:
+            _attached[descriptor[0]] = np.load(descriptor[0], mmap_mode='r')
+        return _attached[descriptor[0]]
+    name, shape, dtype = descriptor
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=_attached[name].buf)
+
+
+def detach(descriptor):
+    if descriptor is not None and descriptor[0] in _attached:
+        attached = _attached.pop(descriptor[0])
+        if len(descriptor) > 1:
+            attached.close()
+
+
+def attachGeometry(key, matrixDescriptors):
+    if matrixDescriptors not in _geometries:
+        # only one geometry is kept, arrays of the previous one are not used by the owner anymore
+        for previous in list(_geometries):
+            del _geometries[previous]
+            for descriptor in previous:
+                detach(descriptor)
+        _geometries[matrixDescriptors] = createGeometry(*key, matrix=tuple(attach(d) for d in matrixDescriptors))
+    return _geometries[matrixDescriptors]
+
+
+def projectIterations(imageDescriptor, geometryKey, matrixDescriptors, from_iteration, to_iteration, dtype=np.float64):
+    geometry = attachGeometry(geometryKey, matrixDescriptors)
+    return geometry.project(attach(imageDescriptor), from_iteration, to_iteration, dtype)
+
+
+# backprojects sinogram columns of iterations starting at 'from_iteration' into private accumulator of the worker
+def backprojectIterations(accumulatorDescriptor, geometryKey, matrixDescriptors, columns, from_iteration):
+    geometry = attachGeometry(geometryKey, matrixDescriptors)
+    accumulator = attach(accumulatorDescriptor)
+    accumulator[...] = 0
+    geometry.backprojectColumns(columns, from_iteration, out=accumulator)
+
+
+def shareArray(array):
+    if array is None:
+        return None
+    # file removed from geometry cache (the mapping stays valid in this process) is copied to shared memory
+    if isinstance(array, np.memmap) and array.filename is not None and array.filename.endswith('.npy') \
+            and os.path.exists(array.filename):
+        return MappedArray(array)
+    return SharedArray(array)
+
+
+# sums arrays pairwise, level by level (tree reduction), result is stored in the first array
+def treeSum(arrays):
+    step = 1
+    while step < len(arrays):
+        for i in range(0, len(arrays) - step, 2 * step):
+            arrays[i] += arrays[i + step]
+        step *= 2
+    return arrays[0]
+
+
+# splits iterations from 'from_iteration' inclusive to 'to_iteration' exclusive into at most 'count' continuous chunks
+def splitIterations(from_iteration, to_iteration, count):
+    bounds = np.linspace(from_iteration, to_iteration, min(count, to_iteration - from_iteration) + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+# runs projections of one base image in a pool of worker processes, the image and the ray geometry are
+# shared with the workers through shared memory; the pool is created on first use and reused afterwards
+class ParallelProjector:
+
+    def __init__(self, imageArray, workers):
+        self.workers = workers
+        self.image = SharedArray(imageArray)
+        self.executor = None
+        self.geometryKey = None
+        self.matrix = None
+        self.accumulators = []
+
+    # replaces shared image, shared memory block is reused if the image has the same shape and type
+    def setImage(self, imageArray):
+        if self.image.array.shape == imageArray.shape and self.image.array.dtype == imageArray.dtype:
+            self.image.array[...] = imageArray
+        else:
+            self.image.close()
+            self.image = SharedArray(imageArray)
+
+    def getExecutor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    # places matrix of the geometry in shared memory (unless it is already there),
+    # memory-mapped matrix is not copied, workers map the same files
+    def shareGeometry(self, geometry):
+        if self.geometryKey != geometry.key:
+            self.releaseGeometry()
+            self.matrix = tuple(shareArray(a) for a in (geometry.indptr, geometry.indices, geometry.weights))
+            self.geometryKey = geometry.key
+        return tuple(None if a is None else a.descriptor for a in self.matrix)
+
+    def releaseGeometry(self):
+        if self.matrix is not None:
+            for a in self.matrix:
+                if a is not None:
+                    a.close()
+        self.matrix = None
+        self.geometryKey = None
+
+    # sinogram columns of iterations from 'from_iteration' inclusive to 'to_iteration' exclusive, accumulated
+    # in 'dtype'; chunks of iterations are projected by the workers and merged in order
+    def project(self, geometry, from_iteration, to_iteration, dtype=np.float64):
+        matrixDescriptors = self.shareGeometry(geometry)
+        executor = self.getExecutor()
+
+        chunks = splitIterations(from_iteration, to_iteration, self.workers * 4)
+        futures = [executor.submit(projectIterations, self.image.descriptor, geometry.key, matrixDescriptors, a, b, dtype)
+                   for a, b in chunks]
+
+        columns = np.zeros((geometry.numberOfEmitters, to_iteration - from_iteration), dtype=dtype)
+        for (a, b), future in zip(chunks, futures):
+            columns[:, a - from_iteration:b - from_iteration] = future.result()
+        return columns
+
+    # backprojection of sinogram columns of iterations starting at 'from_iteration', every worker backprojects
+    # a disjoint range of iterations into its own accumulator (in shared memory), accumulators are summed with
+    # a tree reduction; returns the summed image
+    def backproject(self, geometry, columns, from_iteration):
+        to_iteration = from_iteration + columns.shape[1]
+        matrixDescriptors = self.shareGeometry(geometry)
+        executor = self.getExecutor()
+
+        chunks = splitIterations(from_iteration, to_iteration, self.workers)
+        if len(self.accumulators) < len(chunks) or self.accumulators[0].array.shape != geometry.shape:
+            self.releaseAccumulators()
+            self.accumulators = [SharedArray(np.zeros(geometry.shape)) for _ in range(self.workers)]
+
+        futures = [executor.submit(backprojectIterations, accumulator.descriptor, geometry.key, matrixDescriptors,
+                                   np.ascontiguousarray(columns[:, a - from_iteration:b - from_iteration]), a)
+                   for accumulator, (a, b) in zip(self.accumulators, chunks)]
+        for future in futures:
+            future.result()
+
+        return treeSum([accumulator.array for accumulator in self.accumulators[:len(chunks)]])
+
+    def releaseAccumulators(self):
+        for accumulator in self.accumulators:
+            accumulator.close()
+        self.accumulators = []
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.releaseGeometry()
+        self.releaseAccumulators()
+        self.image.close()
@@ -0,0 +1,128 @@
+import numpy as np
+
+from Rasterizer import rasterizeLines
+
+# Projectors turn rays (arrays of emitter positions x0, y0 and detector positions x1, y1) into a ray/pixel matrix
+# in CSR layout (indptr, indices, weights) for an image with given shape, see Geometry.ScanGeometry.
+# Pixel (x, y) covers square [x, x + 1) x [y, y + 1), weights is None when every crossed pixel counts as 1.
+
+
+# pixels of bresenham lines (endpoints truncated to integers), every pixel with weight 1
+def bresenhamProjector(x0, y0, x1, y1, shape):
+    xs, ys, indptr = rasterizeLines(x0.astype(np.int64), y0.astype(np.int64), x1.astype(np.int64), y1.astype(np.int64),
+                                    shape[0], shape[1])
+    return indptr, xs * shape[1] + ys, None
+
+
+# Siddon's method: weight of pixel is exact length of the part of the ray inside the pixel
+def siddonProjector(x0, y0, x1, y1, shape, batchSize=1 << 22):
+    w, h = shape
+    # parametric positions (0 - emitter, 1 - detector) of crossings with all vertical and horizontal pixel borders
+    samples = w + h + 4
+    return buildMatrix(len(x0), samples, batchSize,
+                       lambda rays: siddonBatch(x0[rays], y0[rays], x1[rays], y1[rays], w, h))
+
+
+def siddonBatch(x0, y0, x1, y1, w, h):
+    dx = x1 - x0
+    dy = y1 - y0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ax = (np.arange(w + 1)[None, :] - x0[:, None]) / dx[:, None]
+        ay = (np.arange(h + 1)[None, :] - y0[:, None]) / dy[:, None]
+    alphas = np.concatenate((np.zeros((len(x0), 1)), np.ones((len(x0), 1)), ax, ay), axis=1)
+    # rays parallel to an axis never cross its borders, such crossings become zero-length segments at 0
+    alphas[~np.isfinite(alphas)] = 0
+    np.clip(alphas, 0, 1, out=alphas)
+    alphas.sort(axis=1)
+
+    # every segment between two consecutive crossings lies in one pixel, found by its midpoint
+    middles = (alphas[:, 1:] + alphas[:, :-1]) / 2
+    lengths = np.diff(alphas, axis=1) * np.hypot(dx, dy)[:, None]
+    px = np.floor(x0[:, None] + middles * dx[:, None]).astype(np.intp)
+    py = np.floor(y0[:, None] + middles * dy[:, None]).astype(np.intp)
+
+    valid = (lengths > 1e-9) & (px >= 0) & (px < w) & (py >= 0) & (py < h)
+    return valid, px * h + py, lengths
+
+
+# Joseph's method: ray is sampled once per column (or row, for steep rays) of pixels, at the pixel centers line,
+# value between two neighbouring pixels is interpolated linearly; weights include length of the step
+def josephProjector(x0, y0, x1, y1, shape, batchSize=1 << 22):
+    w, h = shape
+    # every sample contributes to two pixels
+    samples = 2 * max(w, h)
+    return buildMatrix(len(x0), samples, batchSize,
+                       lambda rays: josephBatch(x0[rays], y0[rays], x1[rays], y1[rays], w, h))
+
+
+def josephBatch(x0, y0, x1, y1, w, h):
+    dx = x1 - x0
+    dy = y1 - y0
+
+    # x-major rays are sampled at x = i + 0.5, other rays at y = i + 0.5
+    xMajor = np.abs(dx) >= np.abs(dy)
+    major0 = np.where(xMajor, x0, y0)[:, None]
+    minor0 = np.where(xMajor, y0, x0)[:, None]
+    dMajor = np.where(xMajor, dx, dy)[:, None]
+    dMinor = np.where(xMajor, dy, dx)[:, None]
+    majorSize = np.where(xMajor, w, h)[:, None]
+    minorSize = np.where(xMajor, h, w)[:, None]
+
+    major = np.arange(max(w, h))[None, :] + 0.5
+    # samples of rays with dMajor == 0 (zero-length rays) are not finite, they are masked out below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = (major - major0) / dMajor
+        slope = dMinor / dMajor
+        minor = minor0 + alpha * dMinor
+        step = np.sqrt(1 + slope * slope)
+
+        # neighbouring pixels of the sample in minor direction and their interpolation weights
+        t = np.nan_to_num(minor - 0.5)
+        lower = np.floor(t)
+        fraction = t - lower
+        lower = lower.astype(np.intp)
+        weights = np.stack(((1 - fraction) * step, fraction * step), axis=2)
+
+    inSegment = (major < majorSize) & (alpha >= 0) & (alpha <= 1) & (dMajor != 0)
+    majorIndex = np.broadcast_to(np.arange(max(w, h))[None, :], alpha.shape)
+
+    minors = np.stack((lower, lower + 1), axis=2)
+    valid = inSegment[:, :, None] & (minors >= 0) & (minors < minorSize[:, :, None]) & (weights > 0)
+
+    majors = np.broadcast_to(majorIndex[:, :, None], minors.shape)
+    px = np.where(xMajor[:, None, None], majors, minors)
+    py = np.where(xMajor[:, None, None], minors, majors)
+
+    n = len(x0)
+    return valid.reshape(n, -1), (px * h + py).reshape(n, -1), weights.reshape(n, -1)
+
+
+# builds CSR matrix from batches of rays; batch(rays) returns 2D arrays (ray x sample) with validity mask,
+# flat pixel index and weight of every sample, 'samples' is the number of samples per ray
+def buildMatrix(numberOfRays, samples, batchSize, batch):
+    raysInBatch = max(1, batchSize // max(samples, 1))
+
+    counts = np.zeros(numberOfRays, dtype=np.intp)
+    indices = []
+    weights = []
+    for first in range(0, numberOfRays, raysInBatch):
+        rays = np.arange(first, min(first + raysInBatch, numberOfRays))
+        valid, pixels, values = batch(rays)
+        counts[rays] = np.count_nonzero(valid, axis=1)
+        indices.append(pixels[valid])
+        weights.append(values[valid])
+
+    indptr = np.zeros(numberOfRays + 1, dtype=np.intp)
+    np.cumsum(counts, out=indptr[1:])
+    if not indices:
+        return indptr, np.zeros(0, dtype=np.intp), np.zeros(0)
+    return indptr, np.concatenate(indices).astype(np.intp), np.concatenate(weights)
+
+
+# available projectors by name (own projectors with the same signature can be added here)
+PROJECTORS = {
+    'bresenham': bresenhamProjector,
+    'siddon': siddonProjector,
+    'joseph': josephProjector,
+}
@@ -1,19 +1,69 @@
+import os
+
 from PIL import Image
 import numpy as np
-import time
+
+import Filters
+import Geometry
+import GeometryCache
+import Instrumentation
+import Metrics
+import Rebinning
+import Subsampling
+from Parallel import ParallelProjector
+
+# version of file format written by Radon.save_state
+STATE_VERSION = 1
+
+# types of sinogram and reconstruction arrays: 'single' halves memory and memory traffic of projection,
+# backprojection and normalization at the cost of float32 rounding
+PRECISIONS = {'double': np.float64, 'single': np.float32}
+
+# number of values normalized at once into integer output (see normalizeInto)
+NORMALIZE_BLOCK = 1 << 16
 
 class Radon:
 
     def __init__(self, baseImage, startRotation=0, numberOfEmitters=10, emittersAngularSpan=1.57075,
-                 rotationDelta=0.04363, useFilter=False):
+                 rotationDelta=0.04363, useFilter=False, filterType='ram-lak', projector='bresenham',
+                 reconstructionMode='ray', beam='arc', workers=None, dtype=np.float64, storageDir=None, checkpointFile=None,
+                 checkpointInterval=None, geometryCache=None, geometryCacheSize=GeometryCache.DEFAULT_MAX_BYTES):
 
         self.baseImage = baseImage
         self.baseImageArray = np.array(baseImage.convert('L'))
 
+        # type of sinogram and reconstruction arrays, in which projections are accumulated (e.g. np.float32 to halve memory,
+        # see PRECISIONS) and directory in which they are
+        # stored as memory-mapped .npy files (None - arrays are kept in memory)
+        self.dtype = np.dtype(dtype)
+        self.storageDir = storageDir
+
+        # state is saved to checkpointFile (see save_state) after every checkpointInterval computed iterations
+        # of sinogram and reconstruction (None - no automatic checkpoints)
+        self.checkpointFile = checkpointFile
+        self.checkpointInterval = checkpointInterval
+
+        # directory of on-disk geometry cache shared by processes and sessions (None - geometry is kept only in memory)
+        # and its size limit in bytes, see GeometryCache
+        self.geometryCache = geometryCache
+        self.geometryCacheSize = geometryCacheSize
+
+        # metrics recorded after every reconstruction step (see trackMetrics)
+        self.metricsTracker = None
+
+        # timers and counters of computations, disabled by default (see enableInstrumentation)
+        self.instrumentation = None
+
+        # number of worker processes used to compute sinogram and reconstruction (None or 1 - compute in this process)
+        self.workers = workers
+        self.parallelProjector = None
+
         self.configAndReset(startRotation=startRotation, numberOfEmitters=numberOfEmitters,
-                            emittersAngularSpan=emittersAngularSpan, rotationDelta=rotationDelta, useFilter=useFilter)
+                            emittersAngularSpan=emittersAngularSpan, rotationDelta=rotationDelta, useFilter=useFilter,
+                            filterType=filterType, projector=projector, reconstructionMode=reconstructionMode, beam=beam)
 
-    def configAndReset(self, startRotation=None, numberOfEmitters=None, emittersAngularSpan=None, rotationDelta=None, useFilter=None):
+    def configAndReset(self, startRotation=None, numberOfEmitters=None, emittersAngularSpan=None, rotationDelta=None, useFilter=None,
+                       filterType=None, projector=None, reconstructionMode=None, beam=None):
         if startRotation != None:
             self.startRotation = startRotation
         if numberOfEmitters != None:
@@ -24,12 +74,31 @@ class Radon:
             self.rotationDelta = rotationDelta
         if useFilter != None:
             self.useFilter = useFilter
+        if filterType != None:
+            self.filterType = filterType
+        if projector != None:
+            self.projector = projector   # name of ray/pixel projector, see Projectors.PROJECTORS
+        if reconstructionMode != None:
+            self.reconstructionMode = reconstructionMode   # 'ray' - smearing along rays, 'pixel' - pixel-driven backprojection
+        if beam != None:
+            self.beam = beam   # scanner geometry, see Geometry.BEAMS
 
         # variables to hold current progress of computation
         self.currentSinogramIteration = 0
         self.currentReconstructionIteration = 0
+        self.lastCheckpointIterations = 0
+        if self.metricsTracker is not None:
+            self.metricsTracker.reset(self.baseImageArray)
+
+        self.numberOfIterations = Geometry.iterationCount(self.beam, self.rotationDelta)
+
+        # ray geometry is computed on first use (see getGeometry)
+        self.geometry = None
+        self.reconstructionGeometry = None
 
-        self.numberOfIterations = int(np.pi / rotationDelta)
+        # fan-beam sinogram rebinned to parallel beam (and filtered) and its maximum, computed for reconstruction
+        self.rebinnedSinogram = None
+        self.rebinnedMax = 0
 
         # original image properties
         imgWidth = self.baseImageArray.shape[0]
@@ -38,8 +107,16 @@ class Radon:
         self.imageCenter = (imgWidth / 2, imgHeight / 2)
 
         # arrays to store sinogram
-        self.radonmatrix = np.zeros((self.numberOfEmitters, self.numberOfIterations))
-        self.radonmatrixNorm = np.zeros((self.numberOfEmitters, self.numberOfIterations))
+        self.radonmatrix = self.allocate('radonmatrix', (self.numberOfEmitters, self.numberOfIterations))
+
+        # filtered sinogram (columns are filtered as soon as they are computed) and its running maximum used for
+        # normalization; normalized sinogram is not stored, it is computed when read (see radonmatrixNorm);
+        # fan-beam sinogram is filtered only after rebinning (see reconstructionColumns)
+        if self.filtersColumns():
+            self.radonmatrixFiltered = self.allocate('radonmatrixFiltered', (self.numberOfEmitters, self.numberOfIterations))
+        else:
+            self.radonmatrixFiltered = self.radonmatrix
+        self.sinogramMax = 0
 
         # reconstructed image properties
         reconstrWidth = imgWidth
@@ -47,9 +124,8 @@ class Radon:
         self.reconstrCenter = (reconstrWidth / 2, reconstrHeight / 2)
         self.reconstrRadius = np.sqrt((reconstrWidth * reconstrWidth) + (reconstrHeight * reconstrHeight)) / 2
 
-        # arrays to store reconstructed image
-        self.reconstrImage = np.zeros((reconstrWidth, reconstrHeight))
-        self.reconstrImageNorm = self.reconstrImage.copy()
+        # array to store reconstructed image (normalized image is computed when read, see reconstrImageNorm)
+        self.reconstrImage = self.allocate('reconstrImage', (reconstrWidth, reconstrHeight))
 
         # helper values for computation
         self.scannerRadius = np.sqrt((imgWidth * imgWidth) + (imgHeight * imgHeight)) / 2   # half of original image diagonal
@@ -59,15 +135,28 @@ class Radon:
     def reset(self):
         self.configAndReset()
 
+    # returns zeroed array for sinogram or reconstruction, memory-mapped to 'name'.npy in storageDir if it is set
+    def allocate(self, name, shape):
+        if self.storageDir is None:
+            return np.zeros(shape, dtype=self.dtype)
+        os.makedirs(self.storageDir, exist_ok=True)
+        return np.lib.format.open_memmap(os.path.join(self.storageDir, name + '.npy'), mode='w+', dtype=self.dtype, shape=shape)
+
+    # replaces base image (e.g. with next slice of a volume) and resets computation,
+    # precomputed geometry and worker processes are reused
+    def setImage(self, baseImage):
+        self.baseImage = baseImage
+        self.baseImageArray = np.array(baseImage.convert('L'))
+        if self.parallelProjector is not None:
+            self.parallelProjector.setImage(self.baseImageArray)
+        self.configAndReset()
+
     # returns current state of sinogram
     def getSinogram(self):
         return Image.fromarray(self.radonmatrixNorm)
 
     # calculates sinogram using Radon Transform from 'from_iteration' inclusive to 'to_iteration' exclusive
     def generateSinogram(self, from_iteration=None, to_iteration=None):
-
-        # s_time = time.time()
-
         if from_iteration == None:
             from_iteration = self.currentSinogramIteration
         if to_iteration == None:
@@ -76,95 +165,174 @@ class Radon:
         if from_iteration >= self.numberOfIterations or to_iteration > self.numberOfIterations:
             return
 
-        # current roation of all emitters (indices from 0 to self.numberOfEmitters - 1) and detectors (indices from self.numberOfEmitters to 2*self.numberOfEmitters - 1) in radians
-        rotation = np.arange(self.numberOfEmitters)
-        rotation = np.concatenate((rotation, rotation))
-
-        initRotation = self.startRotation + from_iteration * self.rotationDelta - self.halfOfSpan
-        rotation = rotation * self.angleGapBetweenSensors + initRotation
-        rotation[self.numberOfEmitters:] += np.pi
-
-        for iter in range(from_iteration, to_iteration):
-            rotation += self.rotationDelta
-
-            x = self.scannerRadius * np.cos(rotation) + self.imageCenter[0]
-            y = self.scannerRadius * np.sin(rotation) + self.imageCenter[1]
-
-            last = len(x) - 1
-            for i in range(self.numberOfEmitters):
-                points = self.bresenham(int(x[i]), int(y[i]), int(x[last - i]), int(y[last - i]), self.baseImageArray.shape[0], self.baseImageArray.shape[1])
-                self.radonmatrix[i, iter] = self.sumPixels(points, self.baseImageArray)
-
-            self.currentSinogramIteration += 1
-
-        if self.useFilter:
-            tmpRadon = self.filter(self.radonmatrix)
-        else:
-            tmpRadon = self.radonmatrix.copy()
-        self.radonmatrixNorm = tmpRadon / (np.max(tmpRadon) / 255)
-
-        # print("sinogram: ", (time.time() - s_time))
+        if to_iteration > from_iteration:
+            with self.instrumented():
+                geometry = self.getGeometry()
+                if self.workers is not None and self.workers > 1:
+                    with Instrumentation.phase('pixelSummation'):
+                        columns = self.getParallelProjector().project(geometry, from_iteration, to_iteration, self.dtype)
+                    self.countRays('projected', geometry, from_iteration, to_iteration)
+                else:
+                    columns = geometry.project(self.baseImageArray, from_iteration, to_iteration, self.dtype)
+                self.radonmatrix[:, from_iteration:to_iteration] = columns
+                self.currentSinogramIteration += to_iteration - from_iteration
+
+                self.normalizeSinogram(from_iteration, to_iteration)
+            self.autoCheckpoint()
+
+    # calculates whole sinogram from every 'angleStep'-th iteration and every 'detectorStep'-th detector, the rest
+    # is interpolated with 'method' (see Subsampling.METHODS) - a faster, approximate sinogram for previews
+    # and screening runs; its error against the full sinogram is reported by getSubsamplingReport
+    def generateSubsampledSinogram(self, angleStep=4, detectorStep=1, method='linear'):
+        with self.instrumented():
+            geometry = self.getGeometry()
+            samples = Subsampling.projectSampled(geometry, self.baseImageArray, angleStep, detectorStep, self.dtype)
+            with Instrumentation.phase('interpolation'):
+                self.radonmatrix[...] = Subsampling.interpolateSinogram(samples, geometry, angleStep, detectorStep, method)
+            self.currentSinogramIteration = self.numberOfIterations
+            self.sinogramMax = 0
+            self.rebinnedSinogram = None
+            self.normalizeSinogram(0, self.numberOfIterations)
+        self.autoCheckpoint()
+
+    # errors and times of subsampled sinogram against the fully projected one (see Subsampling.errorReport),
+    # computed on the side - sinogram of this object is not changed
+    def getSubsamplingReport(self, angleStep=4, detectorStep=1, method='linear'):
+        return Subsampling.errorReport(self.getGeometry(), self.baseImageArray, angleStep, detectorStep, method)
+
+    # filters sinogram columns from 'from_iteration' inclusive to 'to_iteration' exclusive and updates running maximum;
+    # filter works column by column, so only new columns are filtered - cost of one step does not depend on number
+    # of already computed columns
+    def normalizeSinogram(self, from_iteration, to_iteration):
+        if self.filtersColumns():
+            with Instrumentation.phase('filtering'):
+                self.radonmatrixFiltered[:, from_iteration:to_iteration] = self.filter(self.radonmatrix[:, from_iteration:to_iteration])
+
+        with Instrumentation.phase('normalization'):
+            self.sinogramMax = max(self.sinogramMax, np.max(self.radonmatrixFiltered[:, from_iteration:to_iteration]))
+
+    def filtersColumns(self):
+        return self.useFilter and self.beam != 'fan'
+
+    # normalized (0 - 255) sinogram columns from 'from_iteration' inclusive to 'to_iteration' exclusive
+    def getNormalizedColumns(self, from_iteration, to_iteration):
+        with Instrumentation.phase('normalization'):
+            columns = self.radonmatrixFiltered[:, from_iteration:to_iteration]
+            return normalizeInto(columns, self.sinogramMax, np.empty(columns.shape, dtype=self.dtype))
+
+    # sinogram normalized to 0 - 255, computed when it is read
+    @property
+    def radonmatrixNorm(self):
+        return self.getNormalizedColumns(0, self.numberOfIterations)
+
+    # sinogram normalized to 0 - (2^bits - 1) and written into 'out' (preallocated array of the sinogram shape,
+    # e.g. a slice of an output volume) or into a new uint8 / uint16 array; integer values are rounded
+    def getSinogramArray(self, bits=8, out=None):
+        if out is None:
+            out = np.empty(self.radonmatrix.shape, dtype=np.uint8 if bits <= 8 else np.uint16)
+        with Instrumentation.phase('normalization'):
+            return normalizeInto(self.radonmatrixFiltered, self.sinogramMax, out, (1 << bits) - 1)
+
+    # sets raw sinogram columns of the first columns.shape[1] iterations (e.g. sinogram computed by another object
+    # with the same geometry) and filters them, computation of sinogram continues after them
+    def setSinogram(self, columns):
+        count = columns.shape[1]
+        self.radonmatrix[:, :count] = columns
+        self.currentSinogramIteration = count
+        self.sinogramMax = 0
+        self.rebinnedSinogram = None
+        if count > 0:
+            self.normalizeSinogram(0, count)
 
     def nextIteration(self, count=1):
         prev = self.currentSinogramIteration
-        self.generateSinogram(to_iteration=self.currentSinogramIteration + count)
+        self.generateSinogram(to_iteration=min(self.currentSinogramIteration + count, self.numberOfIterations))
         return self.currentSinogramIteration - prev
     
     def nextReconstructionIteration(self, count=1):
         prev = self.currentReconstructionIteration
-        self.generateReconstruction(to_iteration=self.currentReconstructionIteration + count)
+        self.generateReconstruction(to_iteration=min(self.currentReconstructionIteration + count, self.numberOfIterations))
         return self.currentReconstructionIteration - prev
 
-    # returns coordinates of points that belongs to line from (x0, y0) to (x1, y1) and are on the image with width w and height h
-    def bresenham(self, x0, y0, x1, y1, w, h):
-        dx = abs(x1 - x0)
-        dy = abs(y1 - y0)
-
-        if x0 > x1:
-            sx = -1
-        else:
-            sx = 1
-        if y0 > y1:
-            sy = -1
-        else:
-            sy = 1
-
-        err = dx - dy
-
-        x = []
-        y = []
-        added = False
-        while x0 != x1 or y0 != y1:
-            if x0 >= 0 and x0 < w and y0 >= 0 and y0 < h:
-                x.append(x0)
-                y.append(y0)
-                added = True
-            elif added: # line 'was' on the image and will never return again (any of the following pixels won't meet the condition of the previous if statement)
-                break
-            e2 = err * 2
-            if e2 > -dy:
-                err -= dy
-                x0 += sx
-            if e2 < dx:
-                err += dx
-                y0 += sy
-
-        if x0 > 0 and x0 < w and y0 > 0 and y0 < h:
-            x.append(x0)
-            y.append(y0)
-        return [x, y]
-
-    def sumPixels(self, points, imageArray):
-        return np.sum(imageArray[points[0], points[1]])
+    # starts collecting timers of phases and counters of rays and pixels of computations of this object,
+    # returns the Instrumentation object (see Instrumentation; hooks can be added to it)
+    def enableInstrumentation(self):
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation.Instrumentation()
+        return self.instrumentation
+
+    def disableInstrumentation(self):
+        self.instrumentation = None
+
+    # timers and counters collected since instrumentation was enabled (None when it is disabled)
+    def getReport(self):
+        return None if self.instrumentation is None else self.instrumentation.report()
+
+    # context in which phases of computations are recorded by instrumentation of this object (if it is enabled)
+    def instrumented(self):
+        if self.instrumentation is None:
+            return Instrumentation.DISABLED
+        return self.instrumentation.activate()
+
+    # counts rays of iterations from 'from_iteration' inclusive to 'to_iteration' exclusive and their pixels
+    # (used when computation is done by worker processes, which are not instrumented)
+    def countRays(self, kind, geometry, from_iteration, to_iteration):
+        if Instrumentation.isActive():
+            firstRay, lastRay = geometry.rowRange(from_iteration, to_iteration)
+            Instrumentation.count(kind + 'Rays', lastRay - firstRay)
+            Instrumentation.count(kind + 'Pixels', geometry.indptr[lastRay] - geometry.indptr[firstRay])
+
+    # returns precomputed ray geometry of the current configuration (shared by all Radon objects with the same parameters)
+    def getGeometry(self):
+        if self.geometry is None:
+            self.geometry = self.loadGeometry(self.beam)
+        return self.geometry
+
+    # geometry of reconstruction - parallel beam for fan-beam scans (their sinograms are rebinned), otherwise scan geometry
+    def getReconstructionGeometry(self):
+        if self.beam != 'fan':
+            return self.getGeometry()
+        if self.reconstructionGeometry is None:
+            self.reconstructionGeometry = self.loadGeometry('parallel')
+        return self.reconstructionGeometry
+
+    def loadGeometry(self, beam):
+        if self.geometryCache is not None:
+            return GeometryCache.getGeometry(self.geometryCache, self.baseImageArray.shape, self.startRotation,
+                                             self.numberOfEmitters, self.emittersAngularSpan, self.rotationDelta,
+                                             self.projector, self.geometryCacheSize, beam)
+        return Geometry.getGeometry(self.baseImageArray.shape, self.startRotation, self.numberOfEmitters,
+                                    self.emittersAngularSpan, self.rotationDelta, self.projector, beam)
+
+    # returns pool of worker processes sharing base image (created on first use)
+    def getParallelProjector(self):
+        if self.parallelProjector is None:
+            self.parallelProjector = ParallelProjector(self.baseImageArray, self.workers)
+        return self.parallelProjector
+
+    # stops worker processes and releases shared memory
+    def close(self):
+        if self.parallelProjector is not None:
+            self.parallelProjector.close()
+            self.parallelProjector = None
+
+    # reconstruction normalized to 0 - 255, computed when it is read (not after every iteration)
+    @property
+    def reconstrImageNorm(self):
+        return normalizeInto(self.reconstrImage, np.max(self.reconstrImage), np.empty(self.reconstrImage.shape, dtype=self.dtype))
+
+    # reconstruction normalized to 0 - (2^bits - 1) (e.g. 12-bit DICOM pixel data) and written into 'out' (preallocated
+    # array of the image shape) or into a new uint8 / uint16 array; integer values are rounded, negative values are clipped
+    def getReconstructionArray(self, bits=8, out=None):
+        if out is None:
+            out = np.empty(self.reconstrImage.shape, dtype=np.uint8 if bits <= 8 else np.uint16)
+        return normalizeInto(self.reconstrImage, np.max(self.reconstrImage), out, (1 << bits) - 1)
 
     def getReconstruction(self):
         return Image.fromarray(self.reconstrImageNorm)
     
     # calculates image reconstruction using Inverse Radon Transform
     def generateReconstruction(self, from_iteration=None, to_iteration=None):
-
-        # s_time = time.time()
-
         if from_iteration == None:
             from_iteration = self.currentReconstructionIteration
         if to_iteration == None:
@@ -172,67 +340,184 @@ class Radon:
 
         if from_iteration >= self.numberOfIterations or to_iteration > self.numberOfIterations:
             return
+        # fan-beam sinogram is rebinned as a whole, so it has to be complete
+        if self.beam == 'fan' and self.currentSinogramIteration < self.numberOfIterations:
+            return
 
-        # current roation of all emitters (indices from 0 to self.numberOfEmitters - 1) and detectors (indices from self.numberOfEmitters to 2*self.numberOfEmitters - 1) in radians
-        rotation = np.arange(self.numberOfEmitters)
-        rotation = np.concatenate((rotation, rotation))
-
-        initRotation = self.startRotation + from_iteration * self.rotationDelta - self.halfOfSpan
-        rotation = rotation * self.angleGapBetweenSensors + initRotation
-        rotation[self.numberOfEmitters:] += np.pi
-
-        for iter in range(from_iteration, to_iteration):
-            rotation += self.rotationDelta
-
-            x = self.reconstrRadius * np.cos(rotation) + self.reconstrCenter[0]
-            y = self.reconstrRadius * np.sin(rotation) + self.reconstrCenter[1]
-
-            last = len(x) - 1
-            for i in range(self.numberOfEmitters):
-                points = self.bresenham(int(x[i]), int(y[i]), int(x[last - i]), int(y[last - i]), self.reconstrImage.shape[0], self.reconstrImage.shape[1])
-                self.reconstrImage[points[0], points[1]] += self.radonmatrixNorm[i, iter]
-
-            self.currentReconstructionIteration += 1
-
-        self.reconstrImageNorm = self.reconstrImage / (np.max(self.reconstrImage) / 255)
-
-        # print("reconstruction: ", (time.time() - s_time))
-
-    def rampFilter(self, size):
-        n = np.concatenate((
-                np.arange(1, size / 2 + 1, 2, dtype=int),
-                np.arange(size / 2 - 1, 0, -2, dtype=int))
-        )
-        f = np.zeros(size)
-        f[0] = 0.25
-        f[1::2] = -1 / (np.pi * n) ** 2
-
-        return 2 * np.real(np.fft.fft(f))
+        if to_iteration > from_iteration:
+            with self.instrumented():
+                geometry, first, columns = self.reconstructionColumns(from_iteration, to_iteration)
+                if self.reconstructionMode == 'pixel':
+                    geometry.backprojectPixelColumns(columns, first, out=self.reconstrImage)
+                elif self.workers is not None and self.workers > 1:
+                    with Instrumentation.phase('backprojection'):
+                        self.reconstrImage += self.getParallelProjector().backproject(geometry, columns, first)
+                    self.countRays('backprojected', geometry, first, first + columns.shape[1])
+                else:
+                    geometry.backprojectColumns(columns, first, out=self.reconstrImage)
+                self.currentReconstructionIteration += to_iteration - from_iteration
+            if self.metricsTracker is not None:
+                self.metricsTracker.update(self.currentReconstructionIteration, self.reconstrImage)
+            self.autoCheckpoint()
+
+    # returns geometry of reconstruction, its first iteration and normalized sinogram columns backprojected in reconstruction
+    # iterations from 'from_iteration' inclusive to 'to_iteration' exclusive; fan-beam sinogram is rebinned to parallel
+    # beam (and filtered) on first use, its iterations are mapped proportionally to iterations of the parallel geometry
+    def reconstructionColumns(self, from_iteration, to_iteration):
+        if self.beam != 'fan':
+            return self.getGeometry(), from_iteration, self.getNormalizedColumns(from_iteration, to_iteration)
+
+        geometry = self.getReconstructionGeometry()
+        if self.rebinnedSinogram is None:
+            with Instrumentation.phase('rebinning'):
+                self.rebinnedSinogram = Rebinning.rebinFanToParallel(self.radonmatrix, self.getGeometry(), geometry)
+            if self.useFilter:
+                with Instrumentation.phase('filtering'):
+                    self.rebinnedSinogram = self.filter(self.rebinnedSinogram)
+            self.rebinnedMax = np.max(self.rebinnedSinogram)
+
+        first = from_iteration * geometry.numberOfIterations // self.numberOfIterations
+        last = to_iteration * geometry.numberOfIterations // self.numberOfIterations
+        with Instrumentation.phase('normalization'):
+            columns = self.rebinnedSinogram[:, first:last]
+            return geometry, first, normalizeInto(columns, self.rebinnedMax, np.empty(columns.shape, dtype=self.dtype))
+
+    # progressive (multi-resolution) computation: sinogram and reconstruction are computed first for the base image
+    # downsampled 2^(levels-1) times, with proportionally fewer emitters and angles, then for every finer level;
+    # yields (factor, sinogram, reconstruction) for every level (as PIL images, reconstruction upsampled to the size
+    # of the base image); the last level (factor 1) is computed by this object itself, unless 'includeFull' is False;
+    # levels where the downsampled image would be smaller than 'minSize' pixels are skipped
+    def generateProgressive(self, levels=3, includeFull=True, minSize=32):
+        width, height = self.baseImageArray.shape
+        for level in reversed(range(levels)):
+            factor = 2 ** level
+            if factor == 1:
+                if includeFull:
+                    self.generateSinogram()
+                    self.generateReconstruction()
+                    yield 1, self.getSinogram(), self.getReconstruction()
+            elif min(width, height) // factor >= minSize:
+                radon = self.levelRadon(factor)
+                radon.generateSinogram()
+                radon.generateReconstruction(from_iteration=0)
+                yield factor, radon.getSinogram(), radon.getReconstruction().resize((height, width), resample=Image.BILINEAR)
+
+    # Radon object for the base image downsampled 'factor' times, with 'factor' times fewer emitters and angles
+    def levelRadon(self, factor):
+        width, height = self.baseImageArray.shape
+        image = Image.fromarray(self.baseImageArray).resize((max(1, height // factor), max(1, width // factor)), resample=Image.BOX)
+        rotationDelta = self.rotationDelta * factor
+        if int(np.pi / rotationDelta) < 2:
+            rotationDelta = self.rotationDelta
+        return Radon(image, startRotation=self.startRotation, numberOfEmitters=max(2, self.numberOfEmitters // factor),
+                     emittersAngularSpan=self.emittersAngularSpan, rotationDelta=rotationDelta, useFilter=self.useFilter,
+                     filterType=self.filterType, projector=self.projector, reconstructionMode=self.reconstructionMode, beam=self.beam,
+                     dtype=self.dtype, geometryCache=self.geometryCache, geometryCacheSize=self.geometryCacheSize)
+
+    # saves parameters, progress and computed part of sinogram and reconstruction to .npz file; file is written
+    # under a temporary name and then renamed, so a run killed while saving never leaves a broken file
+    def save_state(self, fileName):
+        state = {
+            'version': STATE_VERSION,
+            'geometryHash': Geometry.geometryHash(self.baseImageArray.shape, self.startRotation, self.numberOfEmitters,
+                                                  self.emittersAngularSpan, self.rotationDelta, self.projector, self.beam),
+            'startRotation': self.startRotation,
+            'numberOfEmitters': self.numberOfEmitters,
+            'emittersAngularSpan': self.emittersAngularSpan,
+            'rotationDelta': self.rotationDelta,
+            'useFilter': self.useFilter,
+            'filterType': self.filterType,
+            'projector': self.projector,
+            'reconstructionMode': self.reconstructionMode,
+            'beam': self.beam,
+            'dtype': self.dtype.str,
+            'currentSinogramIteration': self.currentSinogramIteration,
+            'currentReconstructionIteration': self.currentReconstructionIteration,
+            'baseImage': self.baseImageArray,
+            # filtered sinogram is not saved, it is computed again from raw sinogram when state is loaded
+            'radonmatrix': self.radonmatrix[:, :self.currentSinogramIteration],
+            'reconstrImage': self.reconstrImage,
+        }
+        temporaryName = fileName + '.tmp'
+        with open(temporaryName, 'wb') as stateFile:
+            np.savez(stateFile, **state)
+        os.replace(temporaryName, fileName)
+
+    # creates Radon object from file saved with save_state, computation can be continued from the saved iteration;
+    # raises ValueError when file does not match its geometry hash
+    @classmethod
+    def load_state(cls, fileName, workers=None, storageDir=None, checkpointFile=None, checkpointInterval=None):
+        with np.load(fileName) as state:
+            if int(state['version']) != STATE_VERSION:
+                raise ValueError(f"unsupported state version {int(state['version'])} in '{fileName}'")
+            params = {name: state[name].item() for name in ('startRotation', 'numberOfEmitters', 'emittersAngularSpan',
+                                                             'rotationDelta', 'useFilter', 'filterType', 'projector',
+                                                             'reconstructionMode')}
+            # files saved before beams were added are scans of the original scanner
+            params['beam'] = state['beam'].item() if 'beam' in state else 'arc'
+            baseImage = state['baseImage']
+            geometryHash = Geometry.geometryHash(baseImage.shape, params['startRotation'], params['numberOfEmitters'],
+                                                 params['emittersAngularSpan'], params['rotationDelta'], params['projector'],
+                                                 params['beam'])
+            if geometryHash != str(state['geometryHash']):
+                raise ValueError(f"geometry hash of '{fileName}' does not match its parameters")
+
+            radon = cls(Image.fromarray(baseImage), workers=workers, dtype=np.dtype(str(state['dtype'])),
+                        storageDir=storageDir, checkpointFile=checkpointFile, checkpointInterval=checkpointInterval, **params)
+            radonmatrix = state['radonmatrix']
+            if radonmatrix.shape[0] != radon.numberOfEmitters or radonmatrix.shape[1] > radon.numberOfIterations \
+                    or state['reconstrImage'].shape != radon.reconstrImage.shape:
+                raise ValueError(f"arrays in '{fileName}' do not match its parameters")
+
+            radon.setSinogram(radonmatrix)
+            radon.reconstrImage[...] = state['reconstrImage']
+            radon.currentReconstructionIteration = int(state['currentReconstructionIteration'])
+
+        radon.lastCheckpointIterations = radon.currentSinogramIteration + radon.currentReconstructionIteration
+        return radon
+
+    # saves state to checkpointFile when at least checkpointInterval iterations were computed since the last checkpoint
+    def autoCheckpoint(self):
+        if self.checkpointFile is None or not self.checkpointInterval:
+            return
+        iterations = self.currentSinogramIteration + self.currentReconstructionIteration
+        if iterations - self.lastCheckpointIterations >= self.checkpointInterval:
+            self.save_state(self.checkpointFile)
+            self.lastCheckpointIterations = iterations
 
+    # filters sinogram columns with selected filter (see Filters.FILTER_TYPES)
     def filter(self, sinogram):
-        filtered = sinogram.copy()
-        rlf = self.rampFilter(filtered.shape[0])
-        for i in range(filtered.shape[1]):
-            f = np.fft.fft(filtered[:, i]) * rlf
-            filtered[:, i] = np.real(np.fft.ifft(f))
-
-        return filtered
+        return Filters.filterSinogram(sinogram, self.filterType)
     
+    # root mean square error of normalized reconstruction against base image
     def getRMSE(self):
-        rmse = 0
-
-        imgWidth = self.baseImageArray.shape[0]
-        imgHeight = self.baseImageArray.shape[1]
-
-        if self.baseImageArray.shape != self.reconstrImageNorm.shape:
-            reconstr = np.array(Image.fromarray(self.reconstrImageNorm).resize((imgHeight, imgWidth), resample=Image.NEAREST))
-        else:
-            reconstr = self.reconstrImageNorm
-
-        for i in range(imgWidth):
-            for j in range(imgHeight):
-                rmse += (reconstr[i][j] - self.baseImageArray[i][j])**2
-        rmse = rmse/(imgWidth*imgHeight)
-        rmse = np.sqrt(rmse)
-        
-        print("RMSE =",rmse)
\ No newline at end of file
+        return Metrics.rmse(self.reconstrImageNorm, self.baseImageArray)
+
+    # RMSE, MAE, PSNR and SSIM of normalized reconstruction against base image (see Metrics)
+    def getMetrics(self):
+        return Metrics.computeMetrics(self.reconstrImageNorm, self.baseImageArray)
+
+    # starts recording metrics after every reconstruction step, computed on 'samples' randomly chosen pixels
+    # (None - all pixels); history is in metricsTracker.history and is cleared on reset
+    def trackMetrics(self, samples=4096):
+        self.metricsTracker = Metrics.MetricsTracker(self.baseImageArray, samples)
+
+
+# writes 'source' scaled so that 'maximum' maps to 'maxValue' into 'out' (zeros when maximum is not positive),
+# without full-size temporary arrays: float output is divided in place, integer output is scaled, clipped
+# to 0 - maxValue and rounded in blocks of NORMALIZE_BLOCK values; returns 'out'
+def normalizeInto(source, maximum, out, maxValue=255):
+    if maximum <= 0:
+        out[...] = 0
+    elif out.dtype.kind == 'f':
+        np.divide(source, maximum / maxValue, out=out)
+    else:
+        rows = max(1, NORMALIZE_BLOCK // max(1, out[0].size))
+        block = np.empty((min(rows, out.shape[0]),) + out.shape[1:], dtype=source.dtype if source.dtype.kind == 'f' else np.float64)
+        for first in range(0, out.shape[0], rows):
+            part = block[:min(rows, out.shape[0] - first)]
+            np.divide(source[first:first + len(part)], maximum / maxValue, out=part)
+            np.clip(part, 0, maxValue, out=part)
+            np.rint(part, out=part)
+            out[first:first + len(part)] = part
+    return out
@@ -0,0 +1,107 @@
+import numpy as np
+
+
+# returns coordinates of points that belongs to line from (x0, y0) to (x1, y1) and are on the image with width w and height h
+def bresenham(x0, y0, x1, y1, w, h):
+    dx = abs(x1 - x0)
+    dy = abs(y1 - y0)
+
+    if x0 > x1:
+        sx = -1
+    else:
+        sx = 1
+    if y0 > y1:
+        sy = -1
+    else:
+        sy = 1
+
+    err = dx - dy
+
+    x = []
+    y = []
+    added = False
+    while x0 != x1 or y0 != y1:
+        if x0 >= 0 and x0 < w and y0 >= 0 and y0 < h:
+            x.append(x0)
+            y.append(y0)
+            added = True
+        elif added: # line 'was' on the image and will never return again (any of the following pixels won't meet the condition of the previous if statement)
+            break
+        e2 = err * 2
+        if e2 > -dy:
+            err -= dy
+            x0 += sx
+        if e2 < dx:
+            err += dx
+            y0 += sy
+
+    if x0 > 0 and x0 < w and y0 > 0 and y0 < h:
+        x.append(x0)
+        y.append(y0)
+    return [x, y]
+
+
+# rasterizes many lines at once, giving exactly the same pixels as bresenham for every line;
+# x0, y0, x1, y1 are integer arrays with endpoints of the lines (e.g. all rays of one iteration or of the whole scan),
+# returns flat arrays xs, ys with pixels of all lines (line after line) and array 'offsets' such that
+# pixels of line i are xs[offsets[i]:offsets[i + 1]], ys[offsets[i]:offsets[i + 1]]
+# lines are processed in batches of at most 'batchSize' walked pixels to keep temporary arrays small
+def rasterizeLines(x0, y0, x1, y1, w, h, batchSize=1 << 20):
+    x0 = np.asarray(x0, dtype=np.int64).ravel()
+    y0 = np.asarray(y0, dtype=np.int64).ravel()
+    x1 = np.asarray(x1, dtype=np.int64).ravel()
+    y1 = np.asarray(y1, dtype=np.int64).ravel()
+
+    # bresenham makes exactly max(dx, dy) steps, every step moves along the major axis
+    dx = np.abs(x1 - x0)
+    dy = np.abs(y1 - y0)
+    steps = np.maximum(dx, dy)
+    walked = np.cumsum(steps + 1)
+
+    counts = np.zeros(len(x0), dtype=np.intp)
+    xs = []
+    ys = []
+    first = 0
+    while first < len(x0):
+        done = walked[first - 1] if first > 0 else 0
+        last = max(first + 1, int(np.searchsorted(walked, done + batchSize, side='right')))
+
+        x, y, line = walkLines(x0[first:last], y0[first:last], x1[first:last], y1[first:last],
+                               dx[first:last], dy[first:last], steps[first:last], w, h)
+        counts[first:last] = np.bincount(line, minlength=last - first)
+        xs.append(x)
+        ys.append(y)
+        first = last
+
+    offsets = np.zeros(len(x0) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    if not xs:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), offsets
+    return np.concatenate(xs).astype(np.intp), np.concatenate(ys).astype(np.intp), offsets
+
+
+# all pixels walked by bresenham for a batch of lines, clipped to the image;
+# returns coordinates and index of line (within the batch) of every pixel that is on the image
+def walkLines(x0, y0, x1, y1, dx, dy, steps, w, h):
+    line = np.repeat(np.arange(len(x0)), steps + 1)
+    lineStarts = np.cumsum(steps + 1) - (steps + 1)
+    k = np.arange(len(line)) - lineStarts[line]
+
+    # after k steps the minor coordinate moved ceil((2 * k * dminor - dmajor) / (2 * dmajor)) times
+    # (closed form of the integer error term of bresenham, including its tie breaking)
+    dMajor = np.maximum(steps, 1)[line]
+    dMinor = np.minimum(dx, dy)[line]
+    minor = (2 * k * dMinor + dMajor - 1) // (2 * dMajor)
+
+    xMajor = (dx >= dy)[line]
+    x = x0[line] + np.where(x1 >= x0, 1, -1)[line] * np.where(xMajor, k, minor)
+    y = y0[line] + np.where(y1 >= y0, 1, -1)[line] * np.where(xMajor, minor, k)
+
+    # coordinates are monotonic, so pixels on the image form one continuous part of the line;
+    # the endpoint is checked with strict inequalities like in bresenham
+    isEnd = k == steps[line]
+    onImage = np.where(isEnd,
+                       (x > 0) & (x < w) & (y > 0) & (y < h),
+                       (x >= 0) & (x < w) & (y >= 0) & (y < h))
+
+    return x[onImage], y[onImage], line[onImage]
@@ -0,0 +1,66 @@
+import functools
+
+import numpy as np
+
+import Geometry
+
+# Rebinning of fan-beam sinograms (see Geometry.FanBeamGeometry) to parallel-beam sinograms (see
+# Geometry.ParallelBeamGeometry), so fan-beam data can be filtered and backprojected like parallel-beam data.
+# Every parallel ray is the same line as some fan ray (source angle b, fan angle g); its value is interpolated
+# bilinearly from the four nearest measured fan rays. Interpolation tables depend only on the two geometries,
+# they are computed once and cached.
+
+
+# line of every ray as (direction angle, signed distance of the line from the scanner center)
+def rayLines(geometry):
+    x0, y0, x1, y1 = geometry.rayEndpoints()
+    direction = np.arctan2(y1 - y0, x1 - x0)
+    distance = (x0 - geometry.center[0]) * np.sin(direction) - (y0 - geometry.center[1]) * np.cos(direction)
+    return direction, distance
+
+
+# interpolation table: for every ray of parallel geometry flat indices of four fan rays in fan sinogram
+# (detectors x iterations, both 4 x rays) and their weights; rays outside the fan get zero weights
+@functools.lru_cache(maxsize=8)
+def rebinningTable(fanKey, parallelKey):
+    # only rays of the geometries are needed, so their matrices are not built
+    fan = Geometry.createGeometry(*fanKey, matrix=(None, None, None))
+    parallel = Geometry.createGeometry(*parallelKey, matrix=(None, None, None))
+
+    # fan ray from source at angle b with fan angle g has direction b + g + pi and distance -radius * sin(g)
+    direction, distance = rayLines(parallel)
+    sine = -distance / fan.radius
+    inside = np.abs(sine) <= np.sin(fan.emittersAngularSpan / 2) + 1e-9
+    fanAngle = np.arcsin(np.clip(sine, -1, 1))
+    sourceAngle = np.mod(direction - fanAngle - np.pi - fan.startRotation, 2 * np.pi)
+
+    # sources are at angles (i + 1) * rotationDelta (relative to startRotation); the last one is followed by the first
+    # one at 2 * pi, so interpolation between them wraps around the circle
+    angles = np.append(fan.iterationAngles() - fan.startRotation, fan.iterationAngles()[0] - fan.startRotation + 2 * np.pi)
+    sourceAngle = np.where(sourceAngle < angles[0], sourceAngle + 2 * np.pi, sourceAngle)
+    i0 = np.clip(np.searchsorted(angles, sourceAngle, side='right') - 1, 0, fan.numberOfIterations - 1)
+    iFraction = np.clip((sourceAngle - angles[i0]) / (angles[i0 + 1] - angles[i0]), 0, 1)
+    i1 = (i0 + 1) % fan.numberOfIterations
+
+    fanAngles = fan.fanAngles()
+    step = fanAngles[1] - fanAngles[0]
+    position = (fanAngle - fanAngles[0]) / step
+    j0 = np.clip(np.floor(position).astype(np.intp), 0, fan.numberOfEmitters - 2)
+    jFraction = np.clip(position - j0, 0, 1)
+
+    columns = fan.numberOfIterations
+    indices = np.stack((j0 * columns + i0, j0 * columns + i1, (j0 + 1) * columns + i0, (j0 + 1) * columns + i1))
+    weights = np.stack(((1 - jFraction) * (1 - iFraction), (1 - jFraction) * iFraction,
+                        jFraction * (1 - iFraction), jFraction * iFraction)) * inside
+
+    indices.setflags(write=False)
+    weights.setflags(write=False)
+    return indices, weights
+
+
+# parallel-beam sinogram (parallel.numberOfEmitters x parallel.numberOfIterations) from fan-beam sinogram
+def rebinFanToParallel(sinogram, fan, parallel):
+    indices, weights = rebinningTable(fan.key, parallel.key)
+    values = np.sum(np.asarray(sinogram, dtype=np.float64).ravel()[indices] * weights, axis=0)
+    return values.reshape(parallel.numberOfIterations, parallel.numberOfEmitters).T
+
@@ -0,0 +1,182 @@
+# Reduced-angle and detector-subsampled forward projection: only every angleStep-th iteration and every detectorStep-th
+# detector (plus the last ones) are ray traced, the rest of the sinogram is interpolated - first along detectors, then
+# along angles - linearly, with cubic (Catmull-Rom) splines or by Fourier zero-padding of the mirrored samples.
+# Cost of the sinogram drops about angleStep * detectorStep times, errorReport measures what it costs in accuracy.
+# usage example: python Subsampling.py example_images/Shepp_logan.jpg --emitters 180 --delta 1 --angle-steps 2 4 --detector-steps 1 2
+
+import argparse
+import functools
+import time
+
+from PIL import Image
+import numpy as np
+
+import Geometry
+import Instrumentation
+
+METHODS = ('linear', 'cubic', 'fft')
+
+
+# indices 0, step, 2 * step, ... of 'count' positions and the last position, so interpolation never extrapolates
+def sampleIndices(count, step):
+    indices = np.arange(0, count, step)
+    if indices[-1] != count - 1:
+        indices = np.append(indices, count - 1)
+    return indices
+
+
+# sampled iterations and detectors of geometry, and matrix entries of their rays: pixel indices, weights (None for
+# unit weights) and offsets of rays (as in segmentSums), iteration by iteration; computed once for every geometry
+@functools.lru_cache(maxsize=8)
+def samplingTable(geometry, angleStep, detectorStep):
+    iterations = sampleIndices(geometry.numberOfIterations, angleStep)
+    detectors = sampleIndices(geometry.numberOfEmitters, detectorStep)
+    rays = (iterations[:, None] * geometry.numberOfEmitters + detectors[None, :]).ravel()
+
+    starts = geometry.indptr[rays]
+    lengths = geometry.indptr[rays + 1] - starts
+    offsets = np.zeros(len(rays) + 1, dtype=np.intp)
+    np.cumsum(lengths, out=offsets[1:])
+    # positions of entries of every ray in the matrix arrays
+    positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+
+    indices = geometry.indices[positions]
+    weights = None if geometry.weights is None else geometry.weights[positions]
+    for array in (iterations, detectors, indices, offsets) + (() if weights is None else (weights,)):
+        array.setflags(write=False)
+    return iterations, detectors, indices, weights, offsets
+
+
+# sums of imageArray along sampled rays, as sinogram of shape (sampled detectors, sampled iterations)
+def projectSampled(geometry, imageArray, angleStep, detectorStep, dtype=np.float64):
+    iterations, detectors, indices, weights, offsets = samplingTable(geometry, angleStep, detectorStep)
+    with Instrumentation.phase('pixelSummation'):
+        values = np.asarray(imageArray).ravel()[indices].astype(dtype)
+        if weights is not None:
+            values *= weights
+        sums = Geometry.segmentSums(values, offsets)
+    Instrumentation.count('projectedRays', len(offsets) - 1)
+    Instrumentation.count('projectedPixels', offsets[-1])
+    return sums.reshape(len(iterations), len(detectors)).T
+
+
+# values at positions 0 - (count - 1) along axis 0 from 'samples' at sampleIndices(count, step); the uniformly
+# sampled part is interpolated with 'method' (see METHODS), the last interval (up to the extra last sample) linearly
+def interpolateAxis(samples, step, count, method='linear'):
+    if method not in METHODS:
+        raise ValueError(f"unknown interpolation method '{method}', expected one of {METHODS}")
+    positions = sampleIndices(count, step)
+    if len(positions) == 1:
+        return np.repeat(samples[:1], count, axis=0)
+
+    targets = np.arange(count)
+    i = np.clip(np.searchsorted(positions, targets, side='right') - 1, 0, len(positions) - 2)
+    fraction = ((targets - positions[i]) / (positions[i + 1] - positions[i])).reshape((-1,) + (1,) * (samples.ndim - 1))
+    values = samples[i] * (1 - fraction) + samples[i + 1] * fraction
+
+    # samples at 0, step, ..., (m - 1) * step
+    m = len(range(0, count, step))
+    if method == 'linear' or step == 1 or m < 3:
+        return values
+    uniform = samples[:m]
+    last = (m - 1) * step + 1
+    if method == 'cubic':
+        values[:last] = catmullRom(uniform, step)
+    else:
+        values[:last] = fourierResample(uniform, step)
+    return values
+
+
+# Catmull-Rom spline through uniform samples (axis 0), 'step' values per interval, (m - 1) * step + 1 values
+def catmullRom(samples, step):
+    m = len(samples)
+    targets = np.arange((m - 1) * step + 1)
+    i = np.minimum(targets // step, m - 2)
+    t = ((targets - i * step) / step).reshape((-1,) + (1,) * (samples.ndim - 1))
+    p0 = samples[np.maximum(i - 1, 0)]
+    p1 = samples[i]
+    p2 = samples[i + 1]
+    p3 = samples[np.minimum(i + 2, m - 1)]
+    return p1 + 0.5 * t * (p2 - p0 + t * (2 * p0 - 5 * p1 + 4 * p2 - p3 + t * (3 * (p1 - p2) + p3 - p0)))
+
+
+# band-limited interpolation of uniform samples (axis 0): samples are mirrored, so the periodic signal has no jump
+# at the ends, and its spectrum is zero-padded 'step' times; (m - 1) * step + 1 values
+def fourierResample(samples, step):
+    m = len(samples)
+    mirrored = np.concatenate((samples, samples[-2:0:-1]))
+    spectrum = np.fft.rfft(mirrored, axis=0)
+    # Nyquist bin of the even-length signal is split between positive and negative frequencies of the longer one
+    spectrum[-1] *= 0.5
+    return np.fft.irfft(spectrum, n=len(mirrored) * step, axis=0)[:(m - 1) * step + 1] * step
+
+
+# full sinogram (numberOfEmitters x numberOfIterations of geometry) from sampled one returned by projectSampled
+def interpolateSinogram(samples, geometry, angleStep, detectorStep, method='linear'):
+    columns = interpolateAxis(samples, detectorStep, geometry.numberOfEmitters, method)
+    return interpolateAxis(columns.T, angleStep, geometry.numberOfIterations, method).T
+
+
+# errors of interpolated sinogram against fully sampled one; 'relative' is RMSE relative to the largest value
+def interpolationError(reference, interpolated):
+    difference = np.asarray(interpolated, dtype=np.float64) - reference
+    rmse = float(np.sqrt(np.mean(difference * difference)))
+    peak = float(np.max(np.abs(reference)))
+    return {'rmse': rmse, 'mae': float(np.mean(np.abs(difference))), 'max': float(np.max(np.abs(difference))),
+            'relative': rmse / peak if peak > 0 else 0.0}
+
+
+# errors of subsampled sinogram against fully projected reference, with times of both projections
+# and fraction of ray traced sinogram cells
+def errorReport(geometry, imageArray, angleStep, detectorStep, method='linear'):
+    # sampling table is built once for a geometry (like the geometry itself), so it is not timed
+    iterations, detectors = samplingTable(geometry, angleStep, detectorStep)[:2]
+
+    s_time = time.perf_counter()
+    reference = geometry.project(imageArray)
+    referenceTime = time.perf_counter() - s_time
+
+    s_time = time.perf_counter()
+    sinogram = interpolateSinogram(projectSampled(geometry, imageArray, angleStep, detectorStep), geometry,
+                                   angleStep, detectorStep, method)
+    subsampledTime = time.perf_counter() - s_time
+
+    report = {'angleStep': angleStep, 'detectorStep': detectorStep, 'method': method,
+              'sampled': len(iterations) * len(detectors) / reference.size,
+              'reference_s': referenceTime, 'subsampled_s': subsampledTime}
+    report.update(interpolationError(reference, sinogram))
+    return report
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='computed tomography scan simulator - error of subsampled sinograms')
+    parser.add_argument('images', nargs='+', help='image files')
+    parser.add_argument('--emitters', type=int, default=180, help='number of emitters')
+    parser.add_argument('--span', type=float, default=180, help='angular span of emitters in degrees')
+    parser.add_argument('--delta', type=float, default=1, help='rotation delta in degrees')
+    parser.add_argument('--projector', default='bresenham')
+    parser.add_argument('--beam', choices=list(Geometry.BEAMS), default='arc', help='scanner geometry')
+    parser.add_argument('--angle-steps', nargs='+', type=int, default=[2, 4], help='every n-th angle is projected')
+    parser.add_argument('--detector-steps', nargs='+', type=int, default=[1, 2], help='every n-th detector is projected')
+    parser.add_argument('--methods', nargs='+', choices=METHODS, default=list(METHODS), help='interpolation methods')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    for fileName in args.images:
+        imageArray = np.array(Image.open(fileName).convert('L'))
+        geometry = Geometry.getGeometry(imageArray.shape, 0, args.emitters, np.radians(args.span), np.radians(args.delta),
+                                        args.projector, args.beam)
+        for angleStep in args.angle_steps:
+            for detectorStep in args.detector_steps:
+                for method in args.methods:
+                    r = errorReport(geometry, imageArray, angleStep, detectorStep, method)
+                    print(f"{fileName} angles/{angleStep} detectors/{detectorStep} {method}: "
+                          f"{r['subsampled_s']:.3f} s ({r['reference_s'] / r['subsampled_s']:.1f}x faster), "
+                          f"RMSE = {r['rmse']:.3f} ({100 * r['relative']:.2f}%), max = {r['max']:.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
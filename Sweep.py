@@ -0,0 +1,159 @@
+# parameter sweep: quality and cost of scans over a grid of numbers of emitters, angular spans and rotation deltas,
+# for every image and filter variant; results are appended to a CSV file, so an interrupted sweep is resumed
+# by running the same command again (points already in the file are skipped)
+# usage example: python Sweep.py example_images/Shepp_logan.jpg --emitters 90 180 360 --spans 90 180 --deltas 0.5 1 2 --filters none ram-lak hann
+
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import functools
+import itertools
+import os
+import time
+
+from PIL import Image
+import numpy as np
+
+import Filters
+import Metrics
+from Radon import Radon
+
+FIELDS = ['image', 'numberOfEmitters', 'emittersAngularSpan', 'rotationDelta', 'projector', 'filter',
+          'setup_s', 'sinogram_s', 'filter_s', 'reconstruction_s', 'total_s'] + list(Metrics.METRICS)
+
+# columns which identify a point of the sweep
+KEY_FIELDS = FIELDS[:6]
+
+
+# base image is loaded once in every worker process
+@functools.lru_cache(maxsize=4)
+def loadImage(fileName):
+    image = Image.open(fileName)
+    image.load()
+    return image
+
+
+# key of a point of the sweep, the same for a row read from CSV and for a computed one
+def pointKey(image, numberOfEmitters, emittersAngularSpan, rotationDelta, projector, filterName):
+    return (image, int(numberOfEmitters), float(emittersAngularSpan), float(rotationDelta), projector, filterName)
+
+
+def rowKey(row):
+    return pointKey(*(row[field] for field in KEY_FIELDS))
+
+
+# one job - one image and geometry: sinogram is computed once and shared by all filter variants
+# ('none' - no filter, otherwise filter type), returns result row for every variant
+def runJob(fileName, numberOfEmitters, emittersAngularSpan, rotationDelta, projector, filters, geometryCache=None):
+    s_time = time.time()
+    radon = Radon(loadImage(fileName), numberOfEmitters=numberOfEmitters, emittersAngularSpan=np.radians(emittersAngularSpan),
+                  rotationDelta=np.radians(rotationDelta), projector=projector, geometryCache=geometryCache)
+    radon.getGeometry()
+    setupTime = time.time() - s_time
+
+    s_time = time.time()
+    radon.generateSinogram()
+    sinogram = radon.radonmatrix.copy()
+    sinogramTime = time.time() - s_time
+
+    rows = []
+    for filterName in filters:
+        s_time = time.time()
+        if filterName == 'none':
+            radon.configAndReset(useFilter=False)
+        else:
+            radon.configAndReset(useFilter=True, filterType=filterName)
+        radon.setSinogram(sinogram)
+        filterTime = time.time() - s_time
+
+        s_time = time.time()
+        radon.generateReconstruction(from_iteration=0)
+        reconstructionTime = time.time() - s_time
+
+        row = {'image': fileName, 'numberOfEmitters': numberOfEmitters, 'emittersAngularSpan': emittersAngularSpan,
+               'rotationDelta': rotationDelta, 'projector': projector, 'filter': filterName, 'setup_s': setupTime,
+               'sinogram_s': sinogramTime, 'filter_s': filterTime, 'reconstruction_s': reconstructionTime,
+               'total_s': setupTime + sinogramTime + filterTime + reconstructionTime}
+        row.update(radon.getMetrics())
+        rows.append(row)
+    radon.close()
+    return rows
+
+
+# keys of points already stored in results file
+def finishedPoints(fileName):
+    if not os.path.exists(fileName):
+        return set()
+    with open(fileName, newline='') as resultsFile:
+        return {rowKey(row) for row in csv.DictReader(resultsFile)}
+
+
+# jobs (image, numberOfEmitters, emittersAngularSpan, rotationDelta, projector, filters) of the grid without
+# the finished points, filters of one job are only the unfinished ones
+def planJobs(images, emitters, spans, deltas, projectors, filters, finished):
+    jobs = []
+    for image, numberOfEmitters, span, delta, projector in itertools.product(images, emitters, spans, deltas, projectors):
+        remaining = [f for f in filters if pointKey(image, numberOfEmitters, span, delta, projector, f) not in finished]
+        if remaining:
+            jobs.append((image, numberOfEmitters, span, delta, projector, remaining))
+    return jobs
+
+
+def runSweep(args):
+    finished = finishedPoints(args.output)
+    jobs = planJobs(args.images, args.emitters, args.spans, args.deltas, args.projectors, args.filters, finished)
+    print(f"{len(finished)} points already finished, {len(jobs)} jobs to run")
+
+    newFile = not os.path.exists(args.output)
+    with open(args.output, 'a', newline='') as resultsFile:
+        writer = csv.DictWriter(resultsFile, fieldnames=FIELDS)
+        if newFile:
+            writer.writeheader()
+
+        # rows are written (and flushed) as soon as a job finishes, so they survive an interruption
+        def save(rows):
+            writer.writerows(rows)
+            resultsFile.flush()
+            for row in rows:
+                print(f"{row['image']} emitters={row['numberOfEmitters']} span={row['emittersAngularSpan']} "
+                      f"delta={row['rotationDelta']} {row['projector']} {row['filter']}: {row['total_s']:.3f} s, "
+                      f"RMSE = {row['rmse']:.3f}")
+
+        if args.workers is None or args.workers <= 1:
+            for job in jobs:
+                save(runJob(*job, geometryCache=args.geometry_cache))
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                # jobs with the most rays first, so the pool is not left waiting for one long job at the end
+                jobs.sort(key=lambda job: -job[1] / job[3])
+                futures = [executor.submit(runJob, *job, geometryCache=args.geometry_cache) for job in jobs]
+                for future in as_completed(futures):
+                    save(future.result())
+    return len(jobs)
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='computed tomography scan simulator - parameter sweep')
+    parser.add_argument('images', nargs='+', help='image files')
+    parser.add_argument('--emitters', nargs='+', type=int, default=[90, 180], help='numbers of emitters')
+    parser.add_argument('--spans', nargs='+', type=float, default=[180], help='angular spans of emitters in degrees')
+    parser.add_argument('--deltas', nargs='+', type=float, default=[1, 2], help='rotation deltas in degrees')
+    parser.add_argument('--projectors', nargs='+', default=['bresenham'])
+    parser.add_argument('--filters', nargs='+', choices=('none',) + Filters.FILTER_TYPES, default=['none', 'ram-lak'],
+                        help="filter variants ('none' - no filter)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of jobs run concurrently')
+    parser.add_argument('--geometry-cache', help='directory of on-disk cache of ray geometries shared by workers and runs')
+    parser.add_argument('-o', '--output', default='sweep.csv', help='CSV file with results (appended, finished points are skipped)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    s_time = time.time()
+    count = runSweep(args)
+    print(f"{count} jobs done in {time.time() - s_time:.3f} s, results in {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
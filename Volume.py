@@ -0,0 +1,254 @@
+# streaming processing of volumes (stacks of slices): every slice goes through sinogram and reconstruction
+# one after another, only a few slices are held in memory at once and results are written to disk as they come
+# usage example: python Volume.py study_dir/ reconstruction.npy --sinograms sinograms.npy --emitters 180 --span 180 --delta 1
+
+import argparse
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageSequence
+import numpy as np
+
+from Radon import PRECISIONS, Radon
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.gif')
+
+
+# slices of image files one after another, every file is closed once its slice is copied
+# (the copy keeps name of the file, e.g. for error messages)
+def fileSlices(fileNames):
+    for fileName in fileNames:
+        with Image.open(fileName) as image:
+            s = image.copy()
+        s.filename = fileName
+        yield s
+
+
+# frames of multi-page image file, the file is closed after its last frame (or when the iterator is closed)
+def frameSlices(fileName):
+    with Image.open(fileName) as image:
+        for frame in ImageSequence.Iterator(image):
+            yield frame.copy()
+
+
+# returns number of slices and iterator over slices (PIL images) of a volume;
+# source can be multi-page TIFF file, DICOM file, directory with images or directory with DICOM series
+def openSource(source):
+    if os.path.isdir(source):
+        images = sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        if images:
+            return len(images), fileSlices(images)
+        # imported only when needed, pydicom is not required for other sources
+        import Dicom
+        reader = Dicom.SeriesReader(source)
+        return len(reader), iter(reader)
+
+    if source.lower().endswith('.dcm'):
+        import Dicom
+        reader = Dicom.SeriesReader(source)
+        return len(reader), iter(reader)
+
+    with Image.open(source) as image:
+        count = getattr(image, 'n_frames', 1)
+    return count, frameSlices(source)
+
+
+# reads slices in a background thread into a bounded queue, so reading of next slices overlaps with computation
+class Prefetcher:
+
+    _END = object()
+
+    def __init__(self, slices, size=4):
+        self.queue = queue.Queue(maxsize=size)
+        self.error = None
+        self.thread = threading.Thread(target=self._read, args=(slices,), daemon=True)
+        self.thread.start()
+
+    def _read(self, slices):
+        try:
+            for s in slices:
+                self.queue.put(s)
+        except Exception as e:
+            self.error = e
+        self.queue.put(Prefetcher._END)
+
+    def __iter__(self):
+        while True:
+            s = self.queue.get()
+            if s is Prefetcher._END:
+                break
+            yield s
+        if self.error is not None:
+            raise self.error
+
+
+# writes slices (normalized to 0 - 255) into memory-mapped .npy file (frames x rows x columns); slices are
+# normalized directly into the file (see frame), without temporary arrays
+class NpyVolumeWriter:
+
+    def __init__(self, fileName, count, frameShape, dtype=np.float32):
+        self.bits = 8
+        self.volume = np.lib.format.open_memmap(fileName, mode='w+', dtype=dtype, shape=(count,) + tuple(frameShape))
+
+    # preallocated array of slice 'index', filled with values of 0 - (2^bits - 1)
+    def frame(self, index):
+        return self.volume[index]
+
+    # called when slice 'index' is filled
+    def written(self, index):
+        pass
+
+    def close(self):
+        self.volume.flush()
+        self.volume = None
+
+
+# collects slices of 'bits' bits per pixel (8, 12 or 16) in a temporary memory-mapped file and saves them
+# as multi-frame DICOM when closed
+class DicomVolumeWriter:
+
+    def __init__(self, fileName, count, frameShape, patientData=None, bits=8):
+        self.fileName = fileName
+        self.patientData = patientData if patientData is not None else {}
+        self.bits = bits
+        self.buffer = tempfile.TemporaryFile()
+        self.volume = np.memmap(self.buffer, mode='w+', dtype=np.uint8 if bits <= 8 else np.uint16,
+                                shape=(count,) + tuple(frameShape))
+
+    def frame(self, index):
+        return self.volume[index]
+
+    def written(self, index):
+        pass
+
+    def close(self):
+        import Dicom
+        Dicom.save_frames_as_dicom(self.fileName, self.volume, self.patientData, self.bits)
+        self.volume = None
+        self.buffer.close()
+
+
+# writes slices as DICOM series (one file per slice) into a directory; slices are normalized into one buffer
+# and queued to a background writer (see Dicom.SeriesWriter), so writing overlaps with computation of next slices
+class SeriesVolumeWriter:
+
+    def __init__(self, directory, count, frameShape, patientData=None, bits=8):
+        import Dicom
+        self.bits = bits
+        self.buffer = np.zeros(frameShape, dtype=np.uint8 if bits <= 8 else np.uint16)
+        self.writer = Dicom.SeriesWriter(directory, patientData, bits, count=count)
+
+    def frame(self, index):
+        return self.buffer
+
+    def written(self, index):
+        self.writer.write(index, self.buffer)
+
+    def close(self):
+        self.writer.close()
+
+
+# output without extension is a directory of DICOM series
+def isSeries(fileName):
+    return fileName is not None and not os.path.splitext(fileName)[1]
+
+
+def createWriter(fileName, count, frameShape, patientData=None, dicomBits=8):
+    if isSeries(fileName):
+        return SeriesVolumeWriter(fileName, count, frameShape, patientData, dicomBits)
+    if fileName.lower().endswith('.dcm'):
+        return DicomVolumeWriter(fileName, count, frameShape, patientData, dicomBits)
+    return NpyVolumeWriter(fileName, count, frameShape)
+
+
+# runs sinogram and reconstruction for every slice of 'source' with one Radon object (one precomputed geometry),
+# raises ValueError for a slice of other size than the first one;
+# reconstructions are written to 'output' (.npy, .dcm or directory of DICOM series, with 'dicomBits' bits per pixel),
+# sinograms optionally to 'sinogramOutput'; 'callback(index, count, radon)' is called after every slice
+def processVolume(source, output, radonParams, sinogramOutput=None, prefetch=4, patientData=None, callback=None, dicomBits=8):
+    count, slices = openSource(source)
+    if isSeries(output) or isSeries(sinogramOutput):
+        # reconstruction and sinogram series belong to one study
+        import Dicom
+        patientData = dict(patientData or {}, StudyInstanceUID=Dicom.generate_uid())
+
+    radon = None
+    writers = []
+    try:
+        for index, image in enumerate(Prefetcher(slices, prefetch)):
+            if radon is None:
+                radon = Radon(image, **radonParams)
+                writers.append((createWriter(output, count, radon.reconstrImage.shape, patientData, dicomBits), 'reconstruction'))
+                if sinogramOutput is not None:
+                    writers.append((createWriter(sinogramOutput, count, radon.radonmatrix.shape, patientData, dicomBits), 'sinogram'))
+            elif image.size != radon.baseImage.size:
+                # all slices are scanned with one geometry, so they must have the size of the first one
+                name = getattr(image, 'filename', '') or f'slice {index + 1}'
+                raise ValueError(f"{name} has size {image.size[0]}x{image.size[1]}, expected "
+                                 f"{radon.baseImage.size[0]}x{radon.baseImage.size[1]} (size of the first slice)")
+            else:
+                radon.setImage(image)
+
+            radon.generateSinogram()
+            radon.generateReconstruction(from_iteration=0)
+
+            # normalized slices are written straight into the output volumes
+            for writer, kind in writers:
+                if kind == 'reconstruction':
+                    radon.getReconstructionArray(writer.bits, writer.frame(index))
+                else:
+                    radon.getSinogramArray(writer.bits, writer.frame(index))
+                writer.written(index)
+            if callback is not None:
+                callback(index, count, radon)
+    finally:
+        for writer, kind in writers:
+            writer.close()
+        if radon is not None:
+            radon.close()
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='computed tomography scan simulator - volume mode')
+    parser.add_argument('source', help='multi-page TIFF, DICOM file, directory with slices or directory with DICOM series')
+    parser.add_argument('output', help='output file for reconstructions (.npy, .dcm or directory for DICOM series)')
+    parser.add_argument('--sinograms', help='output file for sinograms (.npy, .dcm or directory for DICOM series)')
+    parser.add_argument('--start-rotation', type=float, default=0, help='start rotation in degrees')
+    parser.add_argument('--emitters', type=int, default=10, help='number of emitters')
+    parser.add_argument('--span', type=float, default=90, help='angular span of emitters in degrees')
+    parser.add_argument('--delta', type=float, default=5, help='rotation delta in degrees')
+    parser.add_argument('--no-filter', action='store_true', help='do not filter sinogram')
+    parser.add_argument('--precision', choices=list(PRECISIONS), default='double', help='type of sinogram and reconstruction arrays')
+    parser.add_argument('--dicom-bits', type=int, choices=(8, 12, 16), default=8, help='bits per pixel of .dcm outputs')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes used for every slice')
+    parser.add_argument('--geometry-cache', help='directory of on-disk cache of ray geometries shared by runs')
+    parser.add_argument('--prefetch', type=int, default=4, help='number of slices read ahead')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    radonParams = {'startRotation': np.radians(args.start_rotation), 'numberOfEmitters': args.emitters,
+                   'emittersAngularSpan': np.radians(args.span), 'rotationDelta': np.radians(args.delta),
+                   'useFilter': not args.no_filter, 'dtype': PRECISIONS[args.precision], 'workers': args.workers,
+                   'geometryCache': args.geometry_cache}
+
+    s_time = time.time()
+
+    def progress(index, count, radon):
+        print(f"slice {index + 1}/{count} done, {time.time() - s_time:.3f} s")
+
+    try:
+        processVolume(args.source, args.output, radonParams, sinogramOutput=args.sinograms, prefetch=args.prefetch,
+                      callback=progress, dicomBits=args.dicom_bits)
+    except ValueError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())